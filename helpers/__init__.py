@@ -1,7 +1,20 @@
 from . import shapedetector
 from . import utils
-# from . import baiduocr
+from . import geometry
+from . import credentials
+from . import framesource
+from . import baiduocr
 from . import navi
 from . import ocrspace
 from . import ocrprocessing
-from . import pyav
\ No newline at end of file
+from . import tesseractocr
+from . import asyncocr
+from . import ocrengine
+from . import screencache
+from . import templatematch
+from . import listreader
+from . import batchocr
+from . import trackindex
+from . import timestore
+from . import screenchange
+from . import scrcpyinput
@@ -0,0 +1,184 @@
+import asyncio
+import random
+import threading
+import aiohttp
+import logging
+from .credentials import CREDENTIALS
+from .ocrprocessing import OCRResult
+from .framesource import encode_frame
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+OCRSPACE_ENDPOINT = 'https://api.ocr.space/parse/image'
+# responses worth retrying, anything else is the request's fault
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class OCRRequestError(Exception):
+    pass
+
+
+class AsyncOCRClient:
+    """
+    HTTP layer shared by the OCR backends
+
+    One aiohttp session keeps connections to the OCR services alive between calls, so only the
+    first request pays for the TCP and TLS handshakes. The client runs its own event loop in a
+    background thread: bot code stays synchronous and calls `run`, requests from several
+    threads (e.g. one per device) are in flight at the same time, at most max_concurrency.
+
+    Parameters
+    ----------
+    max_concurrency: int
+        maximum number of requests in flight
+    retries: int
+        attempts after the first one on connection errors, timeouts and RETRY_STATUS responses
+    backoff: float
+        seconds before the first retry, doubled for each further one, with jitter
+    timeout: float
+        seconds allowed for one attempt
+    """
+    def __init__(self, max_concurrency=4, retries=3, backoff=0.5, timeout=30):
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.loop = None
+        self.thread = None
+        self.session = None
+        self.semaphore = None
+        self.requests = 0
+        self.retried = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"AsyncOCRClient({self.requests} requests, {self.retried} retries, max {self.max_concurrency} in flight)"
+
+    def start(self):
+        with self.lock:
+            if self.loop is not None:
+                return self
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name='ocr-client', daemon=True)
+            self.thread.start()
+            asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+        return self
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency, keepalive_timeout=60)
+        self.session = aiohttp.ClientSession(
+            connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    def close(self):
+        with self.lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            self.loop = None
+            self.thread = None
+            self.session = None
+
+    def run(self, coro):
+        """Run a coroutine on the client's loop and wait for its result, from any thread"""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def post(self, url, data=None, params=None, headers=None):
+        """
+        POST and return the decoded JSON response, retrying with backoff
+
+        data can be a callable returning the request body, needed for multipart bodies that
+        cannot be sent twice
+        """
+        for attempt in range(self.retries + 1):
+            body = data() if callable(data) else data
+            try:
+                # the slot is only held while the request is in flight, not during backoff
+                async with self.semaphore, self.session.post(url, data=body, params=params, headers=headers) as response:
+                    if response.status not in RETRY_STATUS:
+                        response.raise_for_status()
+                        self.requests += 1
+                        return await response.json(content_type=None)
+                    error = f'HTTP {response.status}'
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = repr(e)
+            if attempt == self.retries:
+                break
+            self.retried += 1
+            wait = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            LOG.info(f'OCR request failed ({error}), retry #{attempt + 1} in {wait:.1f}s')
+            await asyncio.sleep(wait)
+        raise OCRRequestError(f'OCR request to {url} failed after {self.retries + 1} attempts: {error}')
+
+
+CLIENT = AsyncOCRClient()
+
+
+class AsyncOCRSpaceEngine:
+    """
+    OCR.space engine on top of AsyncOCRClient
+
+    recognize blocks like the other engines, recognize_many sends all images at once so ROI
+    crops are read concurrently
+
+    Parameters
+    ----------
+    key: str
+        OCR.space API key
+    client: AsyncOCRClient
+        defaults to the module wide CLIENT shared by all engines
+    endpoint: str
+        e.g. the address of ocrstub for testing
+    options: dict
+        form fields of the request, e.g. OCREngine=2
+    """
+    name = 'ocrspace'
+
+    def __init__(self, key, client=None, endpoint=OCRSPACE_ENDPOINT, OCREngine=1, isOverlayRequired=True,
+                 isTable='true', language='eng', **options):
+        self.client = CLIENT if client is None else client
+        self.endpoint = endpoint
+        self.fields = dict(
+            apikey=key, OCREngine=OCREngine, isOverlayRequired=isOverlayRequired, isTable=isTable,
+            language=language, **options
+        )
+
+    def form(self, data):
+        form = aiohttp.FormData()
+        for name, value in self.fields.items():
+            form.add_field(name, str(value).lower() if isinstance(value, bool) else str(value))
+        form.add_field('file', data, filename='current.png', content_type='image/png')
+        return form
+
+    async def request(self, data):
+        # data: encoded image, frames are encoded in the calling thread to keep the loop free
+        res = await self.client.post(self.endpoint, data=lambda: self.form(data))
+        if isinstance(res, str) or res.get('IsErroredOnProcessing'):
+            message = res if isinstance(res, str) else res.get('ErrorMessage')
+            raise OCRRequestError(f'OCR.space could not process the image: {message}')
+        return res['ParsedResults'][0]
+
+    def recognize(self, img):
+        return self.client.run(self.request(encode_frame(img).getvalue()))
+
+    def recognize_many(self, imgs):
+        data = [encode_frame(img).getvalue() for img in imgs]
+
+        async def gather():
+            return await asyncio.gather(*[self.request(item) for item in data])
+        return self.client.run(gather())
+
+    def parse(self, d, raw):
+        return OCRResult(d, raw=raw).parse_raw_ocrspace()
+
+
+def get_async_ocrspace_engine(key_file='config/ocrspaceapi.yml', client=None, **kwargs):
+    # client: AsyncOCRClient or its keyword arguments, e.g. {'max_concurrency': 8} from config
+    if isinstance(client, dict):
+        client = AsyncOCRClient(**client)
+    return AsyncOCRSpaceEngine(CREDENTIALS.config(key_file)['key'], client=client, **kwargs)
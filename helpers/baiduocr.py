@@ -0,0 +1,67 @@
+import base64
+import logging
+from .asyncocr import CLIENT, OCRRequestError
+from .credentials import CREDENTIALS
+from .ocrprocessing import OCRResult
+from .framesource import encode_frame
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+TOKEN_URL = 'https://aip.baidubce.com/oauth/2.0/token'
+OCR_URL = 'https://aip.baidubce.com/rest/2.0/ocr/v1/{endpoint}'
+# error codes of an invalid or expired access token
+TOKEN_ERRORS = (110, 111)
+
+
+class BaiduEngine:
+    """
+    Baidu OCR engine, e.g. as fallback when OCR.space is down
+
+    The access token is cached by CREDENTIALS for its lifetime (30 days) instead of being
+    requested for every screenshot, and requests go through the shared AsyncOCRClient.
+
+    Parameters
+    ----------
+    endpoint: str
+        'accurate', 'general', 'webimage_loc', ...
+    key_file: str
+        yaml file with client_id and client_secret
+    client: AsyncOCRClient
+        defaults to the module wide asyncocr.CLIENT
+    """
+    name = 'baidu'
+
+    def __init__(self, endpoint='accurate', key_file='config/baiduapi.yml', client=None):
+        self.endpoint = endpoint
+        self.key_file = key_file
+        self.client = CLIENT if client is None else client
+
+    def fetch_token(self):
+        data = dict(CREDENTIALS.config(self.key_file), grant_type='client_credentials')
+        res = self.client.run(self.client.post(TOKEN_URL, data=data))
+        if 'access_token' not in res:
+            raise OCRRequestError(f"Could not get baidu access token: {res.get('error_description', res)}")
+        return res['access_token'], float(res.get('expires_in', 2592000))
+
+    def recognize(self, img):
+        data = {'image': base64.b64encode(encode_frame(img).getvalue()).decode(), 'probability': 'true'}
+        if self.endpoint == 'webimage_loc':
+            data['poly_location'] = 'true'
+        if self.endpoint == 'accurate':
+            data['vertexes_location'] = 'true'
+        url = OCR_URL.format(endpoint=self.endpoint)
+        for attempt in range(2):
+            params = {'access_token': CREDENTIALS.token('baidu', self.fetch_token)}
+            res = self.client.run(self.client.post(url, data=data, params=params))
+            if res.get('error_code') in TOKEN_ERRORS and attempt == 0:
+                LOG.info('Baidu rejected the access token, getting a new one')
+                CREDENTIALS.invalidate('baidu')
+                continue
+            break
+        if 'error_code' in res:
+            raise OCRRequestError(f"Baidu OCR failed: {res['error_code']} {res.get('error_msg')}")
+        return res
+
+    def parse(self, d, raw):
+        return OCRResult(d, raw=raw).parse_raw_baidu()
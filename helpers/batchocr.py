@@ -0,0 +1,183 @@
+import cv2
+import numpy as np
+import logging
+from .ocrprocessing import OCRResult, roi_to_pixels
+from . import ocrspace
+from .framesource import encode_frame
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# upload limit of the OCR.space free tier, with some room for the form fields
+MAX_BYTES = 1000 * 1024
+
+
+def too_large(error):
+    # OCR.space answers "File size exceeds the maximum permissible file size limit", others HTTP 413
+    if getattr(error, 'status', None) == 413:
+        return True
+    message = str(error).lower()
+    return 'file size' in message or 'too large' in message
+
+
+def pack_tiles(shapes, max_width=4096, max_height=4096, gap=48, sizes=None, max_bytes=None):
+    """
+    Place tiles row by row on as few canvases as possible
+
+    Parameters
+    ----------
+    shapes: list of (height, width)
+    max_width, max_height: int
+        canvas size limit of the OCR service
+    gap: int
+        empty pixels between tiles so words of neighbouring tiles are not read as one
+    sizes: list of int
+        encoded size of each tile in bytes
+    max_bytes: int
+        file size limit of the OCR service, a canvas takes tiles until their sizes add up to it
+
+    Returns
+    -------
+    list of canvases, each a list of (tile index, x, y)
+    """
+    canvases = []
+    placed = []
+    x = y = row_height = 0
+    used = 0
+    for i, (h, w) in enumerate(shapes):
+        if w > max_width or h > max_height:
+            raise ValueError(f'Tile {i} of size {w}x{h} does not fit on a {max_width}x{max_height} canvas')
+        size = 0 if sizes is None else sizes[i]
+        if x and x + w > max_width:
+            x = 0
+            y += row_height + gap
+            row_height = 0
+        if placed and (y + h > max_height or (max_bytes is not None and used + size > max_bytes)):
+            canvases.append(placed)
+            placed = []
+            x = y = row_height = used = 0
+        placed.append((i, x, y))
+        x += w + gap
+        row_height = max(row_height, h)
+        used += size
+    if placed:
+        canvases.append(placed)
+    return canvases
+
+
+def tile_canvas(tiles, placed, fill=0):
+    color = any(tile.ndim == 3 for tile in tiles)
+    width = max(x + tiles[i].shape[1] for i, x, y in placed)
+    height = max(y + tiles[i].shape[0] for i, x, y in placed)
+    canvas = np.full((height, width, 3) if color else (height, width), fill, dtype=np.uint8)
+    for i, x, y in placed:
+        tile = tiles[i]
+        if color and tile.ndim == 2:
+            tile = cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR)
+        canvas[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+    return canvas
+
+
+def ocr_batch(d, api, imgs, rois=None, scale=1.0, max_width=4096, max_height=4096, gap=48, max_bytes=MAX_BYTES):
+    """
+    OCR several frames, or the same regions of several frames, with as few requests as possible
+
+    The frames (or their ROI crops) are tiled onto shared canvases, each canvas is sent as one
+    request and every word is given back to the tile its center falls in, in the coordinates
+    of its source frame. Engines with recognize_many read all canvases at once. A canvas the
+    engine still rejects for its file size is read again as two halves, other errors are raised.
+
+    Parameters
+    ----------
+    d: uiautomator2 device used by the results to click
+    api: OCR engine or ocrspace.API
+    imgs: list of np.ndarray
+        BGR or gray frames
+    rois: list of tuple
+        fractional (left, top, right, bottom) boxes read from every frame, whole frames if None
+    scale: float
+        tiles are resized by this factor before packing, e.g. 0.5 fits four times as many
+        screens per request at the cost of small text
+    max_width, max_height, gap: int
+        see pack_tiles
+    max_bytes: int
+        file size limit of the OCR service, tiles are encoded once to estimate the size of a
+        canvas; None for engines without a limit
+
+    Returns
+    -------
+    list of OCRResult
+        one per frame, in order
+    """
+    engine = ocrspace.as_engine(api)
+    tiles = []
+    # (frame index, left, top) of each tile in its frame
+    sources = []
+    for n, img in enumerate(imgs):
+        h, w = img.shape[:2]
+        boxes = [(0, 0, w, h)] if rois is None else [roi_to_pixels(roi, w, h) for roi in rois]
+        for left, top, right, bottom in boxes:
+            tile = img[top:bottom, left:right]
+            if scale != 1:
+                tile = cv2.resize(tile, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            tiles.append(tile)
+            sources.append((n, left, top))
+
+    def pack(ids):
+        shapes = [tiles[i].shape[:2] for i in ids]
+        sizes = None if max_bytes is None else [len(encode_frame(tiles[i]).getvalue()) for i in ids]
+        return [[(ids[j], x, y) for j, x, y in placed] for placed in pack_tiles(shapes, max_width, max_height, gap, sizes, max_bytes)]
+
+    def read(placements):
+        # [(placed, raw)] of the canvases
+        if len(placements) > 1 and hasattr(engine, 'recognize_many'):
+            try:
+                return list(zip(placements, engine.recognize_many([tile_canvas(tiles, placed) for placed in placements])))
+            except Exception as e:
+                if not too_large(e):
+                    raise
+                LOG.warning(f'OCR of {len(placements)} canvases at once was rejected, reading them one by one: {e}')
+        return [item for placed in placements for item in read_canvas(placed)]
+
+    def read_canvas(placed):
+        # [(placed, raw)] of the canvas, or of its two halves when the engine rejects it
+        try:
+            return [(placed, engine.recognize(tile_canvas(tiles, placed)))]
+        except Exception as e:
+            if len(placed) == 1 or not too_large(e):
+                raise
+            LOG.warning(f'OCR of a canvas of {len(placed)} tiles was rejected, reading it in two halves: {e}')
+            ids = [i for i, x, y in placed]
+            half = len(ids) // 2
+            return read(pack(ids[:half]) + pack(ids[half:]))
+
+    words = [[] for _ in imgs]
+    raws = [[] for _ in imgs]
+    canvases = read(pack(list(range(len(tiles)))))
+    for placed, raw in canvases:
+        res = engine.parse(d, raw)
+        for word in res.words:
+            cx, cy = word.center
+            for i, x, y in placed:
+                h, w = tiles[i].shape[:2]
+                if x <= cx < x + w and y <= cy < y + h:
+                    n, left, top = sources[i]
+                    word.x = int(round((word.x - x) / scale)) + left
+                    word.y = int(round((word.y - y) / scale)) + top
+                    word.w = int(round(word.w / scale))
+                    word.h = int(round(word.h / scale))
+                    words[n].append(word)
+                    break
+        for n in {sources[i][0] for i, x, y in placed}:
+            # as parsed, e.g. without the engine index of FallbackEngine, like ocr_frame keeps it
+            raws[n].append(res.raw)
+    LOG.debug(f'Read {len(tiles)} tiles of {len(imgs)} frames with {len(canvases)} requests')
+
+    results = []
+    for n, img in enumerate(imgs):
+        h, w = img.shape[:2]
+        ocrr = OCRResult(d, raw=raws[n][0] if len(raws[n]) == 1 else raws[n]).set_words(words[n])
+        ocrr.rois = None if rois is None else list(rois)
+        ocrr.size = (w, h)
+        results.append(ocrr)
+    return results
@@ -0,0 +1,128 @@
+from pathlib import Path
+import time
+import cv2
+import numpy as np
+import pandas as pd
+import logging
+from . import ocrengine
+from .ocrprocessing import Word, cluster_rows
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+SCREENSHOTS = Path(__file__).absolute().parent.parent.joinpath('screenshots')
+
+
+def get_fixtures(files=None):
+    if files is None:
+        files = sorted(SCREENSHOTS.glob('*.png'))
+    return {Path(f).name: cv2.imread(str(f)) for f in files}
+
+
+def benchmark_engines(engine_names=('ocrspace', 'tesseract'), files=None, repeats=3):
+    """
+    Time recognize + parse of each OCR engine on the screenshot fixtures
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per (engine, fixture) with latency stats in ms and number of words found
+    """
+    fixtures = get_fixtures(files)
+    rows = []
+    for name in engine_names:
+        engine = ocrengine.get_engine(name)
+        for fname, img in fixtures.items():
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                ocrr = engine.parse(None, engine.recognize(img))
+                times.append((time.perf_counter() - start) * 1000)
+            rows.append({
+                'engine': name,
+                'fixture': fname,
+                'min_ms': np.min(times),
+                'mean_ms': np.mean(times),
+                'words': len(ocrr.words),
+            })
+    res = pd.DataFrame(rows)
+    LOG.info(f'\n{res.to_string(index=False)}')
+    return res
+
+
+def synthetic_words(n, row_height=40, width=1920, seed=0):
+    # rows of 1-8 words with a few pixels of vertical jitter, like a dense ranking screen
+    rng = np.random.default_rng(seed)
+    words = []
+    row = 0
+    while len(words) < n:
+        x = int(rng.integers(0, 100))
+        for _ in range(int(rng.integers(1, 9))):
+            if len(words) == n or x > width - 100:
+                break
+            word = Word()
+            word.text = f'w{len(words)}'
+            word.w = int(rng.integers(30, 150))
+            word.h = 24
+            word.x = x
+            word.y = row * row_height + int(rng.integers(-4, 5))
+            words.append(word)
+            x += word.w + int(rng.integers(10, 60))
+        row += 1
+    return [words[i] for i in rng.permutation(len(words))]
+
+
+def legacy_group_rows(words, threshold=20):
+    # line grouping of navi.parse_member_names before cluster_rows, kept as the baseline
+    lines = []
+    for word in words:
+        assigned = False
+        for existing in lines:
+            for existing_word in existing:
+                if word.align(existing_word, threshold=threshold, direction='v'):
+                    for i, item in enumerate(existing):
+                        if word.left_of(item):
+                            existing.insert(i, word)
+                            assigned = True
+                            break
+                    if not assigned:
+                        existing.append(word)
+                        assigned = True
+                    break
+            if assigned:
+                break
+        if not assigned:
+            lines.append([word])
+    return lines
+
+
+def benchmark_row_clustering(sizes=(50, 100, 200, 500), repeats=5):
+    """
+    Time cluster_rows against the previous nested loop grouping on synthetic screens
+
+    Returns
+    -------
+    pd.DataFrame
+        one row per number of words with best time in ms of each implementation
+    """
+    rows = []
+    for n in sizes:
+        words = synthetic_words(n)
+        res = {'words': n}
+        for name, func in (('legacy', legacy_group_rows), ('cluster_rows', cluster_rows)):
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                lines = func(words)
+                times.append((time.perf_counter() - start) * 1000)
+            res[f'{name}_ms'] = np.min(times)
+            res[f'{name}_lines'] = len(lines)
+        rows.append(res)
+    res = pd.DataFrame(rows)
+    LOG.info(f'\n{res.to_string(index=False)}')
+    return res
+
+
+if __name__ == '__main__':
+    benchmark_engines()
+    benchmark_row_clustering()
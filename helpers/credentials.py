@@ -0,0 +1,114 @@
+from pathlib import Path
+import threading
+import time
+import logging
+from .utils import read_yaml_file
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+CONFIG_DIR = Path(__file__).absolute().parent.parent.joinpath('config')
+
+
+class Token:
+    def __init__(self, value, ttl):
+        self.value = value
+        self.expires = time.time() + ttl
+
+    @property
+    def remaining(self):
+        return self.expires - time.time()
+
+
+class CredentialManager:
+    """
+    Keys and access tokens of the OCR services, shared by all backends and threads
+
+    Config files are read once. Tokens are fetched when first needed and kept until they
+    expire; once less than refresh_margin seconds are left, the first caller starts a refresh
+    in the background and everyone keeps using the current token until the new one arrives,
+    so no OCR call waits for a token after the first one.
+
+    Parameters
+    ----------
+    config_dir: str or Path
+        directory of the yaml files, relative file names are looked up there
+    refresh_margin: float
+        seconds before expiry a token is refreshed
+    """
+    def __init__(self, config_dir=CONFIG_DIR, refresh_margin=3600):
+        self.config_dir = Path(config_dir)
+        self.refresh_margin = refresh_margin
+        self.configs = {}
+        self.tokens = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+        # fetches of the same token are serialized, different services do not wait for each other
+        self.fetch_locks = {}
+
+    def config(self, file):
+        """Content of a yaml config file, e.g. config('baiduapi.yml')"""
+        path = Path(file)
+        if not path.is_absolute() and not path.exists():
+            path = self.config_dir.joinpath(path.name)
+        key = str(path)
+        with self.lock:
+            if key not in self.configs:
+                self.configs[key] = read_yaml_file(path)
+            return self.configs[key]
+
+    def token(self, name, fetch):
+        """
+        Cached token of a service
+
+        Parameters
+        ----------
+        name: str
+            service name, tokens are cached per name
+        fetch: callable
+            returns (token, ttl in seconds), called when there is no valid token
+
+        Returns
+        -------
+        str
+        """
+        with self.lock:
+            token = self.tokens.get(name)
+            fetch_lock = self.fetch_locks.setdefault(name, threading.Lock())
+            if token is not None and token.remaining > 0:
+                if token.remaining < self.refresh_margin and name not in self.refreshing:
+                    self.refreshing.add(name)
+                    threading.Thread(target=self._refresh, args=(name, fetch), daemon=True).start()
+                return token.value
+        with fetch_lock:
+            # another thread may have fetched it meanwhile
+            token = self.tokens.get(name)
+            if token is not None and token.remaining > 0:
+                return token.value
+            return self._fetch(name, fetch).value
+
+    def _fetch(self, name, fetch):
+        value, ttl = fetch()
+        token = Token(value, ttl)
+        with self.lock:
+            self.tokens[name] = token
+        LOG.info(f'Got {name} token valid for {ttl / 3600:.1f}h')
+        return token
+
+    def _refresh(self, name, fetch):
+        try:
+            with self.fetch_locks[name]:
+                self._fetch(name, fetch)
+        except Exception as e:
+            LOG.warning(f'Could not refresh {name} token, keeping the current one: {e}')
+        finally:
+            with self.lock:
+                self.refreshing.discard(name)
+
+    def invalidate(self, name):
+        # e.g. after the service rejected the token
+        with self.lock:
+            self.tokens.pop(name, None)
+
+
+CREDENTIALS = CredentialManager()
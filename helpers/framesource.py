@@ -0,0 +1,87 @@
+import io
+import cv2
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class DeviceFrameSource:
+    """Frames captured through uiautomator2, decoded in memory instead of through a file on disk"""
+    def __init__(self, d):
+        self.d = d
+
+    def get_frame(self):
+        return self.d.screenshot(format='opencv')
+
+    def frame_seq(self):
+        # screenshots are taken on request, there is no stream to number
+        return None
+
+    def wait_for_frame(self, after_seq=None, timeout=5):
+        return self.get_frame()
+
+
+class ScrcpyFrameSource:
+    """Latest decoded frame from a running NaiveScrcpyClient, BGR or gray depending on its color_mode"""
+    def __init__(self, client):
+        self.client = client
+
+    def get_frame(self):
+        img = self.client.get_screen_frame()
+        if img is None:
+            raise RuntimeError('No frame has been received from scrcpy yet')
+        return img
+
+    def frame_seq(self):
+        return self.client.frame_seq
+
+    def wait_for_frame(self, after_seq=None, timeout=5):
+        """
+        First frame decoded after after_seq, e.g. frame_seq() taken before a click
+
+        scrcpy only sends frames when the screen changes, so when nothing new arrives within
+        timeout the latest frame is still what is on screen and is returned instead
+        """
+        img = self.client.wait_for_frame(after_seq, timeout)
+        if img is None:
+            return self.get_frame()
+        return img
+
+
+def to_rgb(img):
+    # frames are BGR, or single channel when the scrcpy decoder runs in gray mode
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def get_frame_source(d, source=None):
+    if source is None:
+        return DeviceFrameSource(d)
+    return source
+
+
+def encode_frame(img, ext='.png', name='current'):
+    """
+    Encode a BGR frame once into an in-memory file that can be uploaded directly
+
+    Parameters
+    ----------
+    img: np.ndarray
+        BGR frame
+    ext: str
+        image format understood by cv2.imencode
+    name: str
+        file name reported to the upload, the extension is appended
+    Returns
+    -------
+    io.BytesIO
+    """
+    params = [cv2.IMWRITE_PNG_COMPRESSION, 1] if ext == '.png' else []
+    ok, buf = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f'Could not encode frame as {ext}')
+    file = io.BytesIO(buf.tobytes())
+    file.name = name + ext
+    return file
@@ -0,0 +1,91 @@
+import threading
+import weakref
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def resolve_location(loc, size):
+    """
+    Pixel location on a screen of size (width, height)
+
+    Each coordinate between -1 and 1 is a fraction of the screen, any other is in pixels;
+    negative ones are measured from the right or bottom edge, e.g. (-0.05, 0.1) or (-60, 60)
+    is near the top right corner.
+    """
+    resolved = []
+    for value, length in zip(loc, size):
+        if -1 < value < 1:
+            value *= length
+        if value < 0:
+            value += length
+        resolved.append(value)
+    return resolved
+
+
+class DeviceGeometry:
+    """
+    Screen size of a device, asked once and kept until the screen rotates
+
+    The device is only asked again when a frame, or the scrcpy client, shows the other
+    orientation than the cached size.
+
+    Parameters
+    ----------
+    d: uiautomator2 device, or scrcpyinput.ScrcpyInput
+    client: NaiveScrcpyClient
+        its landscape flag invalidates the cached size when no frame size is given
+    """
+    def __init__(self, d, client=None):
+        self.d = d
+        self.client = client
+        self.size = None
+        self.landscape = None
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f"DeviceGeometry({self.size})"
+
+    def invalidate(self):
+        with self.lock:
+            self.size = None
+
+    def window_size(self, landscape=None):
+        """(width, height) of the device screen in the orientation given, the current one by default"""
+        if landscape is None and self.client is not None:
+            landscape = self.client.landscape
+        with self.lock:
+            if self.size is None or (landscape is not None and landscape != self.landscape):
+                width, height = self.d.window_size()
+                self.size = (width, height)
+                self.landscape = width > height
+                LOG.info(f'Device screen is {width}x{height}')
+            return self.size
+
+    def to_device(self, loc, frame_size=None):
+        """
+        Device pixel location of loc, given on a frame of frame_size
+
+        loc may hold fractions or offsets from the far edges, see resolve_location. Frames
+        downscaled by scrcpy are scaled back up to the device screen.
+        """
+        landscape = None if frame_size is None else frame_size[0] > frame_size[1]
+        width, height = self.window_size(landscape)
+        frame_width, frame_height = frame_size or (width, height)
+        x, y = resolve_location(loc, (frame_width, frame_height))
+        return [int(round(x * width / frame_width)), int(round(y * height / frame_height))]
+
+
+# one geometry per device object, dropped with it
+GEOMETRIES = weakref.WeakKeyDictionary()
+GEOMETRIES_LOCK = threading.Lock()
+
+
+def get_geometry(d, client=None):
+    """Cached geometry of device d, a client given later replaces the one without"""
+    with GEOMETRIES_LOCK:
+        geometry = GEOMETRIES.get(d)
+        if geometry is None or (client is not None and geometry.client is not client):
+            geometry = GEOMETRIES[d] = DeviceGeometry(d, client)
+        return geometry
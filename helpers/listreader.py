@@ -0,0 +1,193 @@
+import cv2
+import numpy as np
+import logging
+from .ocrprocessing import OCRResult, roi_to_pixels, cluster_rows
+from . import ocrspace
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def estimate_scroll(prev, cur, box, expected=None, scale=0.5, tolerance=0.02, min_std=4):
+    """
+    Vertical scroll between two frames from where a band of the previous list shows up again
+
+    A band at the leading edge of the previous list region is matched over the whole region
+    of the new frame. Rows of a list look alike, so phase correlation of the whole region and
+    plain template matching both alias by whole rows; among matches scoring within tolerance
+    of the best one, the one closest to the expected scroll (e.g. the drag distance) is taken.
+
+    Parameters
+    ----------
+    prev, cur: np.ndarray
+        BGR frames before and after the scroll
+    box: tuple
+        (left, top, right, bottom) list region in pixels
+    expected: float
+        approximate scroll in pixels, same sign convention as the returned shift
+    scale: float
+        the region is downscaled by this factor before matching
+    tolerance: float
+        matches scoring this close to the best one are considered equally good
+    min_std: float
+        minimum gray level standard deviation of the matched band
+    Returns
+    -------
+    (shift, score)
+        shift in pixels, positive when the content moved up (list scrolled down), and the
+        normalized correlation of the match; a low score means the screens are not the same list
+    """
+    left, top, right, bottom = box
+    crops = []
+    for img in (prev, cur):
+        crop = img[top:bottom, left:right]
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        if scale != 1:
+            crop = cv2.resize(crop, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        crops.append(crop)
+    prev_crop, cur_crop = crops
+    h = prev_crop.shape[0]
+    band = max(8, h // 5)
+
+    shifts = []
+    scores = []
+    for leading in ('bottom', 'top'):
+        if expected is not None and (expected < 0) == (leading == 'bottom'):
+            continue
+        # the band closest to the leading edge that has some texture, blank bands match anywhere
+        starts = range(h - band, -1, -band // 2) if leading == 'bottom' else range(0, h - band + 1, band // 2)
+        band_top = next((y for y in starts if prev_crop[y:y + band].std() >= min_std), None)
+        if band_top is None:
+            continue
+        res = cv2.matchTemplate(cur_crop, prev_crop[band_top:band_top + band], cv2.TM_CCOEFF_NORMED)[:, 0]
+        # only local maxima compete, the shoulders of one peak are not separate matches
+        padded = np.pad(res, 1, constant_values=-np.inf)
+        peaks = np.flatnonzero((res >= padded[:-2]) & (res >= padded[2:]))
+        shifts.append((band_top - peaks) / scale)
+        scores.append(res[peaks])
+    if not shifts:
+        return 0.0, 0.0
+    shifts = np.concatenate(shifts)
+    scores = np.concatenate(scores)
+    best = np.argmax(scores)
+    if expected is not None:
+        candidates = np.flatnonzero(scores >= scores[best] - tolerance)
+        best = candidates[np.argmin(np.abs(shifts[candidates] - expected))]
+    return float(shifts[best]), float(scores[best])
+
+
+class ListReader:
+    """
+    Reads a scrolling list by OCRing only the rows each scroll reveals
+
+    Words of the previous screen that are still visible are moved by the measured scroll,
+    words outside the list region (headers, buttons) are kept as they are, and only the
+    strip of newly revealed rows is sent to OCR. `offset` accumulates the scroll so rows
+    can be ordered and deduplicated by their position in the whole list.
+
+    Parameters
+    ----------
+    d: uiautomator2 device
+    api: OCR engine
+    region: tuple
+        fractional (left, top, right, bottom) box of the list viewport
+    min_response: float
+        minimum correlation of the scroll estimate to trust it
+    min_shift: float
+        scrolls smaller than this many pixels mean the end of the list was reached
+    """
+    def __init__(self, d, api, region, min_response=0.1, min_shift=2):
+        self.d = d
+        self.api = api
+        self.region = region
+        self.min_response = min_response
+        self.min_shift = min_shift
+        self.img = None
+        self.ocrr = None
+        self.offset = 0
+        self.at_end = False
+
+    def start(self, img, ocrr=None):
+        if ocrr is None:
+            ocrr = ocrspace.ocr_frame(self.d, self.api, img)
+        self.img = img
+        self.ocrr = ocrr
+        self.offset = 0
+        self.at_end = False
+        return ocrr
+
+    def update_frame(self, img):
+        # new reference frame for a list that has not moved since the last reading
+        self.img = img
+
+    def list_position(self, word):
+        # y of the word center from the top of the list as first read
+        return word.center[1] + self.offset
+
+    def advance(self, img, expected=None):
+        """
+        Update the reading with the frame captured after a scroll
+
+        expected is the approximate scroll in pixels, e.g. the drag distance, positive when
+        the list was scrolled down
+
+        Returns
+        -------
+        OCRResult
+            words of the new screen, None when the list did not move (end of list)
+        """
+        h, w = img.shape[:2]
+        left, top, right, bottom = roi_to_pixels(self.region, w, h)
+        shift, response = estimate_scroll(self.img, img, (left, top, right, bottom), expected=expected)
+        if response < self.min_response:
+            LOG.info(f'Scroll estimate unreliable (response {response:.2f}), reading the whole screen')
+            ocrr = ocrspace.ocr_frame(self.d, self.api, img)
+            self.img = img
+            self.ocrr = ocrr
+            return ocrr
+        if abs(shift) < self.min_shift:
+            self.at_end = True
+            return None
+
+        shift = int(round(shift))
+        table = self.ocrr.table
+        in_list = table.in_box((left, top, right, bottom))
+        listed = table.select(in_list)
+        fixed = table.select(~in_list)
+
+        # rows read whole in the previous frame stay valid, the strip to OCR starts right after
+        # the last of them so rows cut by the edge of the previous frame are read again
+        margin = np.median([word.h for word in listed]) / 2 if listed else 0
+        reliable = [
+            row for row in cluster_rows(listed)
+            if min(word.top for word in row) >= top + margin and max(word.bottom for word in row) <= bottom - margin
+        ]
+        if shift > 0:
+            strip_top = top
+            if reliable:
+                strip_top = max(word.bottom for word in reliable[-1]) - shift + 1
+            strip = (left, min(max(top, strip_top), bottom - shift), right, bottom)
+            keep = lambda word: word.top >= top and word.bottom <= strip[1]
+        else:
+            strip_bottom = bottom
+            if reliable:
+                strip_bottom = min(word.top for word in reliable[0]) - shift - 1
+            strip = (left, top, right, max(min(bottom, strip_bottom), top - shift))
+            keep = lambda word: word.bottom <= bottom and word.top >= strip[3]
+
+        kept = []
+        for word in listed:
+            word = word.copy().offset(0, -shift)
+            if keep(word):
+                kept.append(word)
+        strip_roi = (strip[0] / w, strip[1] / h, strip[2] / w, strip[3] / h)
+        strip_res = ocrspace.ocr_frame(self.d, self.api, img, rois=[strip_roi])
+        LOG.info(f'List scrolled {shift}px, read {strip[3] - strip[1]}px strip')
+
+        ocrr = OCRResult(self.d, raw=strip_res.raw).set_words(fixed + kept + strip_res.words)
+        ocrr.size = (w, h)
+        self.offset += shift
+        self.img = img
+        self.ocrr = ocrr
+        return ocrr
@@ -1,12 +1,27 @@
+from collections import Counter
+import heapq
+import threading
 import numpy as np
-import re
 from .utils import istime
+from .ocrprocessing import box_in_box, cluster_rows, extract_table, join_words
+from . import trackindex
+from . import ocrspace
+from .framesource import get_frame_source
+from .templatematch import CLOSE_BUTTON
 import logging
-import time
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Screen regions holding page anchor words, as fractions (left, top, right, bottom) of the screen
+TOP_BAR = (0.0, 0.0, 1.0, 0.15)
+BOTTOM_BAR = (0.0, 0.8, 1.0, 1.0)
+DIALOG_TITLE = (0.15, 0.15, 0.85, 0.32)
+DIALOG_BUTTONS = (0.15, 0.6, 0.85, 0.8)
+# screen size the page offsets were measured on, used when the OCRed frame size is unknown;
+# offsets are given as fractions of the screen so they hold at any resolution
+REFERENCE_SIZE = (1920, 1080)
+
 
 def verify_page(words, ocrr, nmatch=0):
         """
@@ -23,126 +38,116 @@ def verify_page(words, ocrr, nmatch=0):
         -------
         bool
         """
-        if nmatch <= 0 or nmatch >= len(words):
-            return all([ocrr.word_exists(word) for word in words])
-        return sum([ocrr.word_exists(word) for word in words]) > nmatch
-
-
-def parse_member_names(member_name_words):
-    member_names_aligned = []
-    for word in member_name_words:
-        assigned = False
-        for existing in member_names_aligned:
-            for existing_word in existing:
-                if word.align(existing_word, threshold=20, direction='v'):
-                    for i, item in enumerate(existing):
-                        if word.left_of(item):
-                            existing.insert(i, word)
-                            assigned = True
-                            break
-                    if not assigned:
-                        existing.append(word)
-                        assigned = True
-                    break
-            if assigned:
-                break
-        if not assigned:
-            member_names_aligned.append([word])
-
-    member_names = []
-    for line in member_names_aligned:
-        if len(line) > 1:
-            # Remove name parts with no more than 2 characters due to special character
-            newline = []
-            for word in line:
-                if len(word.text) > 2:
-                    newline.append(word)
-        else:
-            newline = line
-        cur_word = newline[0]
-        if len(newline) > 1:
-            for name in newline[1:]:
-                cur_word = cur_word.merge(name)
-        # remove syn tag
-        if cur_word.text.endswith('syn'):
-            cur_word.text = cur_word.text[:-3]
-        if cur_word.text.startswith('9'):
-            cur_word.text = cur_word.text[1:]
-        member_names.append(cur_word)
-
-    return sort_words(member_names, direction='v')
+        return sum([ocrr.has_word(word) for word in words]) >= required_matches(words, nmatch)
+
+
+def required_matches(words, nmatch=0):
+    # all words unless nmatch is strictly between 0 and the number of words, then more than nmatch
+    if nmatch <= 0 or nmatch >= len(words):
+        return len(words)
+    return nmatch + 1
+
+
+def clean_member_name(line):
+    # line: words of one member name, left to right
+    newline = line
+    if len(line) > 1:
+        # Remove name parts with no more than 2 characters due to special character
+        newline = [word for word in line if len(word.text) > 2] or line
+    # joined into a new word so the OCR result itself is left untouched
+    cur_word = join_words(newline)
+    # remove syn tag
+    if cur_word.text.endswith('syn'):
+        cur_word.text = cur_word.text[:-3]
+    if cur_word.text.startswith('9'):
+        cur_word.text = cur_word.text[1:]
+    return cur_word
+
+
+def parse_member_names(member_name_words, tolerance=20):
+    return [clean_member_name(line) for line in cluster_rows(member_name_words, tolerance=tolerance)]
     
 
 def sort_words(word_list, direction='h'):
     if direction not in ('h', 'v'):
         raise ValueError("direction has to be one of ('h', 'v')")
     if direction == 'v':
-        gt = 'bottom_of'
-    if direction == 'h':
-        gt = 'right_of'
-    
-    newlist = []
-    for word in word_list:
-        assigned = False
-        for i, w in enumerate(newlist):
-            if getattr(w, gt)(word):
-                newlist.insert(i, word)
-                assigned = True
-                break
-        if not assigned:
-            newlist.append(word)
-    
-    return newlist
+        return sorted(word_list, key=lambda w: (w.center[1], w.center[0], w.text))
+    return sorted(word_list, key=lambda w: (w.center[0], w.center[1], w.text))
 
 
 class Page:
+    # regions that contain the words checked by verify, None if they can be anywhere on screen
+    rois = None
+    # (image file, box, region) reference images for templatematch.TemplateClassifier, see
+    # templatematch.Template; a match identifies the page without OCR
+    templates = None
+    # pages reached from this one, {page name: name of the method leading there}
+    links = {}
+    # pop-ups that show up on top of other pages and go away with exit
+    interrupt = False
+    # (words, nmatch) rules of verify_page, the page is shown when any of them holds
+    anchors = []
+
     def __init__(self, name=None, ocrr=None):
         self.name = name
         self.ocrr = ocrr
-        self.links = {}
     
     def __repr__(self):
         return f"Page({self.name})"
 
+    def verify(self):
+        return any(verify_page(words, self.ocrr, nmatch=nmatch) for words, nmatch in self.anchors)
+
     def __str__(self):
         return self.__repr__()
 
     
 class NoticePage(Page):
+    rois = [DIALOG_TITLE, DIALOG_BUTTONS]
+    # the "Notice" dialog title, cut with templatematch.save_template
+    templates = [('images/notice_title.png', None, DIALOG_TITLE)]
+    interrupt = True
+    anchors = [(['Notice', 'OK'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name='NoticePage', ocrr=ocrr)
     
-    def verify(self):
-        return verify_page(['Notice', "OK"], self.ocrr)
-
     def exit(self):
         self.ocrr.click("OK")
 
     
 class StartPage(Page):
+    rois = [TOP_BAR, BOTTOM_BAR]
+    # the "Start" button is searched in the bottom centre only, HomePage's "Start Game" button
+    # in the bottom right corner looks much like it
+    templates = [('images/start.png', None, (0.3, 0.7, 0.7, 1.0))]
+    links = {'HomePage': 'start'}
+    anchors = [(['Start', 'Log', 'Out'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name='StartPage', ocrr=ocrr)
     
-    def verify(self):
-        return verify_page(['Start', "Log", 'Out'], self.ocrr)
-
     def start(self):
         self.ocrr.click("Start")
 
     
 class TrackSelectionPage(Page):
+    rois = [TOP_BAR]
+    # fractional (left, top, right, bottom) box of the scrolling track list, below the top bar
+    list_roi = (0.0, 0.15, 1.0, 1.0)
+    links = {'TimeTrialHomePage': 'exit'}
+    anchors = [(['Select', 'Track', 'All'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="TrackSelectionPage", ocrr=ocrr)
     
-    def verify(self):
-        return verify_page(['Select', "Track", "All"], self.ocrr)
-    
     def scroll(self, direction='down', duration=0.2):
         # take tracke (only ones with brackets)
         track_words = []
-        for w, word_list in self.ocrr.res.items():
-            if ("(" in w) or (")" in w):
-                track_words.extend(word_list)
+        for word in self.ocrr.words:
+            if ("(" in word.text) or (")" in word.text):
+                track_words.append(word)
         top_loc = min([word.top for word in track_words])
         mid_loc = np.mean([min([word.left for word in track_words]), max([word.left for word in track_words])])
         bottom_loc = max([word.top for word in track_words])
@@ -151,65 +156,69 @@ class TrackSelectionPage(Page):
             self.ocrr.drag(loc1=[mid_loc, bottom_loc], loc2=[mid_loc, top_loc], duration=duration)
         if direction == "up":
             self.ocrr.drag(loc1=[mid_loc, top_loc], loc2=[mid_loc, bottom_loc], duration=duration)
-        
+        # drag distance, the expected scroll of the list content
+        distance = bottom_loc - top_loc
+        return distance if direction == "down" else -distance
+
     def exit(self):
-        self.ocrr.click(loc=[-60, 60])
-    
-    def select_map(self, map_name):
-        # TODO
-        # scrolls to search for map
-        # builds a database of map locations so in the future don't need to screenshot at every scroll
-        pass
+        self.ocrr.click(loc=[-0.031, 0.056])
+    
+    def select_map(self, map_name, api, index=None, source=None):
+        # jumps to the map with the positions of trackindex.TrackIndex, the list is swept once
+        # to build the index when it does not know the map yet
+        if index is None:
+            index = trackindex.TrackIndex()
+        if index.get(map_name) is None:
+            trackindex.build_track_index(self.ocrr.d, api, self, index=index, source=source)
+            # the sweep leaves the list at its end, select_track starts from the words on screen
+            img = get_frame_source(self.ocrr.d, source).get_frame()
+            self.ocrr = ocrspace.ocr_frame(self.ocrr.d, api, img)
+            self.ocrr.page_class = type(self)
+        return trackindex.select_track(self, map_name, index, api, source=source)
 
         
 class TimeTrialHomePage(Page):
+    rois = [TOP_BAR, BOTTOM_BAR]
+    links = {'TrackSelectionPage': 'change_map', 'StartGameHomePage': 'exit'}
+    anchors = [(['Time', 'Trial', 'Start'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="TimeTrialHomePage", ocrr=ocrr)
+        self.rows = None
+        # pixel (left, top, right, bottom) box of the ranking list, set by get_name_time_pairs
+        self.ranking_box = None
     
-    def verify(self):
-        return verify_page(['Time', 'Trial', 'Start'], self.ocrr)
-        
     def get_name_time_pairs(self):
-        #TODO
         # returns a list of tuples (name_word, time_word)
-        server_words = self.ocrr.get_word('Server')
-        largest_left = 0
-        for w in server_words:
-            if w.left > largest_left:
-                right_loc = w.left
-                top_loc = w.bottom + 40
-                largest_left = w.left
-        
-        ranking_words = self.ocrr.get_word('Ranking')
-        largest_top = 0
-        for w in ranking_words:
-            if w.top > largest_top:
-                left_loc = w.right + 140
-                bottom_loc = w.top - 90
-                largest_top = w.top
-        
-        name_time_words = self.ocrr.get_words_in_box(box=(left_loc, top_loc, right_loc, bottom_loc))
-        members = []
-        times = []
-        for word in name_time_words:
-            if istime(word.text):
-                times.append(word)
-            else:
-                members.append(word)
-        
-        members_clean = parse_member_names(members)
-        
-        sorted_all = sort_words(members_clean + times, direction='v')
-        
-        N = len(sorted_all)
+        # the ranking list sits left of the rightmost "Server" and above the lowest "Ranking"
+        width, height = self.ocrr.size or REFERENCE_SIZE
+        server = max(self.ocrr.get_word('Server'), key=lambda w: w.left)
+        ranking = max(self.ocrr.get_word('Ranking'), key=lambda w: w.top)
+        box = (
+            ranking.right + 0.073 * width,
+            server.bottom + 0.037 * height,
+            server.left,
+            ranking.top - 0.083 * height
+        )
+        self.ranking_box = box
+        self.rows = extract_table(
+            self.ocrr.get_words_in_box(box=box),
+            classify=lambda word: 'time' if istime(word.text) else 'name'
+        )
+
+        # a name is paired with the time on its row, or on the row right below it
         pairs = []
-        for i, word in enumerate(sorted_all):
-            if not istime(word.text):
-                if i < N-1:
-                    nxt = sorted_all[i + 1]
-                    if istime(nxt.text):
-                        pairs.append((word, nxt))
-        
+        pending = None
+        for row in self.rows:
+            name = clean_member_name(row.cells['name']) if 'name' in row.cells else pending
+            if 'time' in row.cells and name is not None:
+                pairs.append((name, row.time))
+                pending = None
+            elif 'time' not in row.cells:
+                pending = name
+            else:
+                pending = None
+
         return pairs
     
     def scroll(self, direction='down', duration=0.2):
@@ -217,91 +226,85 @@ class TimeTrialHomePage(Page):
         #TODO
     
     def exit(self):
-        self.ocrr.click(loc=[50, 20])
+        self.ocrr.click(loc=[0.026, 0.019])
     
     def change_map(self):
         self.ocrr.click("Edit")
         
 
 class StartGameHomePage(Page):
+    links = {'TimeTrialHomePage': 'timetrial', 'HomePage': 'exit'}
+    anchors = [(['Select', 'Mode', 'Training'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="StartGameHomePage", ocrr=ocrr)
     
-    def verify(self):
-        return verify_page(['Select', 'Mode', 'Training'], self.ocrr)
-    
     def timetrial(self):
         self.ocrr.click("Trial")
         
     def exit(self):
-        self.ocrr.click(loc=[50, 20])
+        self.ocrr.click(loc=[0.026, 0.019])
         
 
 class SignInRewardsPage(Page):
+    interrupt = True
+    anchors = [(['Sign', 'Great', 'Gifts', 'AllWeek', 'Week'], 3)]
+
     def __init__(self, ocrr):
         super().__init__(name="SignInRewardsPage", ocrr=ocrr)
     
-    def verify(self):
-        return (
-            verify_page(['Sign', 'Great', 'Gifts', 'AllWeek', 'Week'], self.ocrr, nmatch=3)
-        )
-    
     def exit(self):
         if self.ocrr.word_exists("X"):
             self.ocrr.click("X")
         else:
-            self.ocrr.click(loc=[-170, 100])
+            self.ocrr.click(loc=[-0.089, 0.093])
         
 
 class WelcomePage(Page):
+    interrupt = True
+    anchors = [(['CODEX'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="WelcomePage", ocrr=ocrr)
     
-    def verify(self):
-        return (
-            verify_page(['CODEX'], self.ocrr)
-        )
-    
     def exit(self):
         if self.ocrr.word_exists("X"):
             self.ocrr.click("X")
         else:
-            self.ocrr.click(loc=[-140, 170])
+            self.ocrr.click(loc=[-0.073, 0.157])
 
 
 
 class EventsPage(Page):
+    rois = [TOP_BAR]
+    interrupt = True
+    anchors = [(['Daily', 'Events'], 0), (['Event', 'Center'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="EventsPage", ocrr=ocrr)
     
-    def verify(self):
-        return (
-            verify_page(['Daily', 'Events'], self.ocrr) or
-            verify_page(['Event', 'Center'], self.ocrr)
-        )
-    
-    def claims(self):
+    def claims(self, wait=None):
         LOG.info('Claiming rewards...')
         for i in range(self.ocrr.num_occurrences("Claim"))[::-1]:
-            self.ocrr.repeat_click(word='Claim', occurrence=i, num_clicks=5, delay=1)
+            self.ocrr.repeat_click(word='Claim', occurrence=i, num_clicks=5, delay=1, wait=wait)
     
     def exit(self):
         if self.ocrr.word_exists("X"):
             self.ocrr.click("X")
         else:
-            self.ocrr.click(loc=[-140, 170])
+            self.ocrr.click(loc=[-0.073, 0.157])
 
         
 class HomePage(Page):
+    rois = [BOTTOM_BAR]
+    # the "Potential", "Practice" and "Storage" buttons, cut with templatematch.save_template
+    templates = [('images/home_buttons.png', None, BOTTOM_BAR)]
+    links = {'ClubHomePage': 'club_page', 'StartGameHomePage': 'start_game'}
+    anchors = [(['Potential', 'Practice', 'StorageStart', 'Game'], 2), (['Start', 'Game'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name="HomePage", ocrr=ocrr)
     
-    def verify(self):
-        return (
-            verify_page(['Potential', 'Practice', 'StorageStart', 'Game'], self.ocrr, nmatch=2) or
-            verify_page(['Start', 'Game'], self.ocrr)
-        )
-    
     def club_page(self):
         self.ocrr.click('Club')
     
@@ -310,58 +313,64 @@ class HomePage(Page):
         
 
 class ClubHomePage(Page):
+    links = {'ClubMembersPage': 'members', 'HomePage': 'exit'}
+    anchors = [(['Club', 'CP', 'League', 'Special', 'Drill'], 3)]
+
     def __init__(self, ocrr):
         super().__init__(name="ClubHomePage", ocrr=ocrr)
     
-    def verify(self):
-        return (
-            verify_page(['Club', 'CP', 'League', 'Special', 'Drill'], self.ocrr, nmatch=3)
-        )
-    
     def members(self):
         self.ocrr.click("Members")
     
     def exit(self):
-        self.ocrr.click(loc=[50, 10])
+        self.ocrr.click(loc=[0.026, 0.009])
         
 
 class ClubMembersPage(Page):
+    rois = [TOP_BAR]
+    # scrolling member list, below the column headers and above "Leave Club"
+    list_roi = (0.14, 0.145, 0.945, 0.87)
+    templates = [('screenshots/members_page.png', (0.125, 0.095, 0.96, 0.135))]
+    links = {'ClubHomePage': 'exit'}
+    anchors = [(['Club', 'Name', 'Position', 'Tier', 'Status', 'Activity'], 4)]
+
     def __init__(self, ocrr):
         super().__init__(name="ClubMembersPage", ocrr=ocrr)
         self.members = None
-    
-    def verify(self):
-        return (
-            verify_page(['Club', 'Name', 'Position', 'Tier', 'Status', 'Activity'], self.ocrr, nmatch=4)
-        )
-    
+        self.rows = None
+    
+    def get_table(self):
+        # columns from the header row, rows between the header and "Leave Club"
+        headers = {}
+        for field, text in (
+            ('name', 'Name'),
+            ('position', 'Position'),
+            ('tier', 'Tier'),
+            ('weekly_activity', 'Weekly'),
+            ('total_activity', 'Total'),
+            ('status', 'Status'),
+        ):
+            words = self.ocrr.get_word(text)
+            if words:
+                headers[field] = min(words, key=lambda w: w.top)
+        if 'name' not in headers:
+            raise KeyError('Column header "Name" not found')
+
+        top = max(w.bottom for w in headers.values())
+        bottom = None
+        leave_words = [w for w in self.ocrr.get_word('Club') if w.top > top]
+        if leave_words:
+            bottom = max(w.top for w in leave_words)
+        self.rows = extract_table(self.ocrr.words, headers=headers, top=top, bottom=bottom)
+        return self.rows
+
     def get_members(self):
         # Get all the names underneath "Name" column
-        # left bounded by right of "Club" from "Leave Club"
-        # right bounded by left of "Position"
-        leave_words = self.ocrr.get_word('Club')
-        largest_top = 0
-        for w in leave_words:
-            if w.top > largest_top:
-                left_loc = w.left + 5
-                largest_top = w.top
-                bottom_loc = largest_top - 100
-        
-        position_words = self.ocrr.get_word('Position')
-        smallest_top = float('inf')
-        for w in position_words:
-            if w.top < smallest_top:
-                right_loc = w.left - 5
-                smallest_top = w.top
-                top_loc = w.bottom + 50
-        
-        # get words between these locs
-        member_name_words = self.ocrr.get_words_in_box(box=(left_loc, top_loc, right_loc, bottom_loc))
-        self.members = parse_member_names(member_name_words)
+        self.members = [clean_member_name(row.cells['name']) for row in self.get_table() if 'name' in row.cells]
         
     def scroll(self, direction='down', duration=0.2):
         if self.members is None:
-            self.get_member_names()
+            self.get_members()
 
         if len(self.members) == 0:
             return None
@@ -380,6 +389,9 @@ class ClubMembersPage(Page):
             self.ocrr.drag(loc1=lower_loc, loc2=upper_loc, duration=duration)
         if direction == "up":
             self.ocrr.drag(loc1=upper_loc, loc2=lower_loc, duration=duration)
+        # drag distance, the expected scroll of the list content
+        distance = lower_loc[1] - upper_loc[1]
+        return distance if direction == "down" else -distance
 
     def click_member(self, member):
         if member not in self.members:
@@ -390,34 +402,42 @@ class ClubMembersPage(Page):
     def add_friend(self, member):
         if not self.ocrr.word_exists('Status'):
             raise KeyError('Word "Status" not found')
-        vertical_align = self.ocrr.get_word("Status")[0].left - 50
+        width, height = self.ocrr.size or REFERENCE_SIZE
+        vertical_align = self.ocrr.get_word("Status")[0].left - 0.026 * width
         self.ocrr.click(loc=[vertical_align, member.center[1]])
         return
         
     def exit(self):
-        self.ocrr.click(loc=[50, 10])
+        self.ocrr.click(loc=[0.026, 0.009])
 
 
 class AddFriendPage(Page):
+    rois = [DIALOG_TITLE, DIALOG_BUTTONS]
+    templates = [('images/add_friend_title.png', None, (0.203, 0.218, 0.417, 0.29))]
+    # routes leave through the close button, confirm sends the friend request
+    links = {'ClubMembersPage': 'exit'}
+    anchors = [(['Add', 'as', 'Friend', 'OK'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name='AddFriendPage', ocrr=ocrr)
     
-    def verify(self):
-        return verify_page(['Add', "as", 'Friend', 'OK'], self.ocrr)
-    
     def confirm(self):
         self.ocrr.click('OK')
 
+    def exit(self):
+        left, top, right, bottom = CLOSE_BUTTON[2]
+        self.ocrr.click(loc=[(left + right) / 2, (top + bottom) / 2])
+
 
 class ChatPage(Page):
+    links = {'ClubMembersPage': 'exit'}
+    anchors = [(['Private', 'Chat', 'Send'], 0)]
+
     def __init__(self, ocrr):
         super().__init__(name='ChatPage', ocrr=ocrr)
 
-    def verify(self):
-        return verify_page(['Private', 'Chat', 'Send'], self.ocrr)
-
     def exit(self):
-        self.ocrr.click(loc=[-100, 100])
+        self.ocrr.click(loc=[-0.052, 0.093])
 
 
 PAGES = [
@@ -437,10 +457,186 @@ PAGES = [
 ]
 
 
+def page_rois(pages=PAGES):
+    """
+    Union of the regions needed to verify the given pages, boxes contained in another are dropped
+    Pages without declared regions are skipped, they can only be found with full screen OCR
+    """
+    rois = []
+    for page in pages:
+        for roi in page.rois or []:
+            if roi not in rois:
+                rois.append(roi)
+    return [roi for roi in rois if not any(roi != other and box_in_box(roi, other) for other in rois)]
+
+
+PAGE_CLASSES = {page.__name__: page for page in PAGES}
+
+
+class NavGraph:
+    """
+    Pages as nodes and their links as edges, weighted by how long each transition takes
+
+    Edge costs start at default_latency seconds and follow the measured latencies, smoothed
+    with weight alpha for the newest one, so routes prefer transitions that are fast in practice.
+
+    Parameters
+    ----------
+    pages: list of Page subclasses
+    default_latency: float
+        seconds assumed for a transition never measured
+    alpha: float
+        weight of a new measurement in the running latency
+    """
+    def __init__(self, pages=PAGES, default_latency=2.0, alpha=0.3):
+        self.links = {page.__name__: dict(page.links) for page in pages}
+        self.default_latency = default_latency
+        self.alpha = alpha
+        self.latency = {}
+
+    def __repr__(self):
+        return f"NavGraph({len(self.links)} pages, {sum(len(v) for v in self.links.values())} links)"
+
+    def cost(self, source, target):
+        return self.latency.get((source, target), self.default_latency)
+
+    def record(self, source, target, seconds):
+        """Measured time from the action on source until target was verified"""
+        if (source, target) in self.latency:
+            seconds = self.alpha * seconds + (1 - self.alpha) * self.latency[(source, target)]
+        self.latency[(source, target)] = seconds
+
+    def path(self, source, target):
+        """
+        Cheapest route from page source to page target
+
+        Returns
+        -------
+        list of (page name, method name, next page name)
+            the hops to take in order, empty when already there, None when target cannot be reached
+        """
+        best = {source: 0}
+        previous = {}
+        queue = [(0, source)]
+        while queue:
+            cost, name = heapq.heappop(queue)
+            if name == target:
+                break
+            if cost > best[name]:
+                continue
+            for next_name, method in self.links.get(name, {}).items():
+                next_cost = cost + self.cost(name, next_name)
+                if next_cost < best.get(next_name, float('inf')):
+                    best[next_name] = next_cost
+                    previous[next_name] = (name, method)
+                    heapq.heappush(queue, (next_cost, next_name))
+        if target not in best:
+            return None
+        hops = []
+        name = target
+        while name != source:
+            prev_name, method = previous[name]
+            hops.append((prev_name, method, name))
+            name = prev_name
+        return hops[::-1]
+
+
+# shared by all sessions so every device contributes to the measured latencies
+NAV_GRAPH = NavGraph()
+
+
+class PageIndex:
+    """
+    Anchor words of all pages, indexed to classify a screen in one pass over its words
+
+    Each anchor word points to the rules using it, so the cost depends on the words on screen
+    rather than on the number of pages. Pages matching equally well are ordered by how often
+    they followed the previous page, then by how often they were seen at all.
+
+    Parameters
+    ----------
+    pages: list of Page subclasses
+    """
+    def __init__(self, pages=PAGES):
+        self.pages = list(pages)
+        # (page, words needed) of each rule
+        self.rules = []
+        self.index = {}
+        for page in self.pages:
+            for words, nmatch in page.anchors:
+                rule = len(self.rules)
+                self.rules.append((page, required_matches(words, nmatch)))
+                for word in {word.lower() for word in words}:
+                    self.index.setdefault(word, []).append(rule)
+        self.order = {page: i for i, page in enumerate(self.pages)}
+        self.transitions = Counter()
+        self.seen = Counter()
+        self.lock = threading.Lock()
+        # previous page of each thread, sessions on several devices run in their own threads
+        self.local = threading.local()
+
+    def __repr__(self):
+        return f"PageIndex({len(self.pages)} pages, {len(self.index)} anchor words)"
+
+    @property
+    def previous(self):
+        return getattr(self.local, 'previous', None)
+
+    def scores(self, ocrr):
+        """{page class: number of anchor words found by its best matching rule} of the pages on ocrr"""
+        hits = Counter()
+        for key in ocrr.keys:
+            for rule in self.index.get(key, ()):
+                hits[rule] += 1
+        scores = {}
+        for rule, count in hits.items():
+            page, needed = self.rules[rule]
+            if count >= needed:
+                scores[page] = max(scores.get(page, 0), count)
+        return scores
+
+    def classify(self, ocrr):
+        """
+        All pages whose anchors are on ocrr, most likely first
+
+        Returns
+        -------
+        list of (page class, score)
+        """
+        previous = self.previous
+        return sorted(
+            self.scores(ocrr).items(),
+            key=lambda item: (
+                -item[1], -self.transitions[(previous, item[0])], -self.seen[item[0]], self.order[item[0]]
+            )
+        )
+
+    def observe(self, page):
+        """Count page as shown after the previous page of this thread"""
+        with self.lock:
+            self.transitions[(self.previous, page)] += 1
+            self.seen[page] += 1
+        self.local.previous = page
+
+
+PAGE_INDEX = PageIndex()
+
+
 def get_current_page(ocrr):
-    for page in PAGES:
-        page_item = page(ocrr)
+    if ocrr.page_class is not None:
+        return ocrr.page_class(ocrr)
+    if ocrr.page_hint is not None:
+        # page seen on a near identical frame, usually right but checked on these words
+        page_item = ocrr.page_hint(ocrr)
         if page_item.verify():
+            ocrr.page_class = ocrr.page_hint
+            PAGE_INDEX.observe(ocrr.page_hint)
             return page_item
-    return None
+    matches = PAGE_INDEX.classify(ocrr)
+    if not matches:
+        return None
+    page = matches[0][0]
+    ocrr.page_class = page
+    PAGE_INDEX.observe(page)
+    return page(ocrr)
 
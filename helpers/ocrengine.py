@@ -0,0 +1,107 @@
+from pathlib import Path
+import logging
+from .utils import read_yaml_file
+from . import ocrspace
+from . import tesseractocr
+from . import asyncocr
+from . import baiduocr
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+CONFIG_FILE = 'config/ocr.yml'
+
+
+def make_ocrspace_engine(**kwargs):
+    return ocrspace.OCRSpaceEngine(ocrspace.get_api_endpoint(**kwargs))
+
+
+ENGINES = {
+    'ocrspace': make_ocrspace_engine,
+    'tesseract': tesseractocr.TesseractEngine,
+    'ocrspace_async': asyncocr.get_async_ocrspace_engine,
+    'baidu': baiduocr.BaiduEngine,
+}
+
+
+class FallbackEngine:
+    """Uses the next engine when one fails, e.g. when the OCR.space quota is used up"""
+    def __init__(self, engines):
+        self.engines = engines
+        self.name = '+'.join(engine.name for engine in engines)
+
+    def recognize(self, img):
+        for i, engine in enumerate(self.engines):
+            try:
+                return i, engine.recognize(img)
+            except Exception as e:
+                if i == len(self.engines) - 1:
+                    raise
+                LOG.warning(f'OCR engine {engine.name} failed, falling back to {self.engines[i + 1].name}: {e}')
+
+    def recognize_many(self, imgs):
+        # the first engine reads all images at once when it can, if that fails every image falls back on its own
+        engine = self.engines[0]
+        if hasattr(engine, 'recognize_many'):
+            try:
+                return [(0, raw) for raw in engine.recognize_many(imgs)]
+            except Exception as e:
+                if len(self.engines) == 1:
+                    raise
+                LOG.warning(f'OCR engine {engine.name} failed on {len(imgs)} images, reading them one by one: {e}')
+        return [self.recognize(img) for img in imgs]
+
+    def parse(self, d, raw):
+        i, raw = raw
+        return self.engines[i].parse(d, raw)
+
+
+def make_engine(name, config, defaults):
+    if name not in ENGINES:
+        raise ValueError(f"OCR engine has to be one of {tuple(ENGINES)}, got {name}")
+    kwargs = dict(defaults.get(name, {}))
+    kwargs.update(config.get(name) or {})
+    return ENGINES[name](**kwargs)
+
+
+def get_engine(name=None, config_file=CONFIG_FILE, **defaults):
+    """
+    Build the OCR engine selected in config
+
+    config/ocr.yml looks like
+        engine: tesseract
+        tesseract:
+            min_conf: 30
+
+    or, for OCR.space over pooled connections with Baidu when it fails
+        engine: ocrspace_async
+        fallback: baidu
+        ocrspace_async:
+            OCREngine: 2
+            client:
+                max_concurrency: 8
+
+    Parameters
+    ----------
+    name: str
+        engine name, overrides the `engine` entry of the config file; the `fallback` entry
+        (a name or list of names) is used when this engine fails
+    config_file: str
+        yaml file selecting the engine, defaults to ocrspace if missing
+    defaults: dict
+        per engine keyword arguments, e.g. ocrspace={'OCREngine': 2},
+        updated by the section of the same name in the config file
+    Returns
+    -------
+    engine with recognize(img) and parse(d, raw) methods
+    """
+    config = read_yaml_file(config_file) if Path(config_file).exists() else {}
+    if name is None:
+        name = config.get('engine', 'ocrspace')
+    fallback = config.get('fallback') or []
+    names = [name] + ([fallback] if isinstance(fallback, str) else list(fallback))
+    LOG.info(f"Using OCR engine {' then '.join(names)}")
+    engines = [make_engine(engine_name, config, defaults) for engine_name in names]
+    if len(engines) == 1:
+        return engines[0]
+    return FallbackEngine(engines)
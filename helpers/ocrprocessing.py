@@ -1,6 +1,9 @@
 import logging
 import numpy as np
+import re
 import time
+from bisect import bisect_left, bisect_right
+from .geometry import get_geometry
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
@@ -27,8 +30,25 @@ def point_in_box(pt, box):
     left, top, right, bottom = box
     return (left <= pt[0] <= right) and (top <= pt[1] <= bottom)
 
+
+def box_in_box(inner, outer):
+    return all([
+        inner[0] >= outer[0],
+        inner[1] >= outer[1],
+        inner[2] <= outer[2],
+        inner[3] <= outer[3]
+    ])
+
+
+def roi_to_pixels(roi, width, height):
+    # roi is (left, top, right, bottom) in fractions of the screen size
+    left, top, right, bottom = roi
+    return int(left * width), int(top * height), int(right * width), int(bottom * height)
+
     
 class Word:
+    __slots__ = ('text', 'line', 'x', 'y', 'w', 'h')
+
     def __init__(self):
         self.text = None
         self.line = None
@@ -51,6 +71,36 @@ class Word:
         self.h = int(word['Height'])
         return self
 
+    def copy(self):
+        newword = Word()
+        for attr in Word.__slots__:
+            setattr(newword, attr, getattr(self, attr))
+        return newword
+
+    def offset(self, dx, dy):
+        self.x += dx
+        self.y += dy
+        return self
+
+    def parse_tesseract(self, data, i):
+        self.text = data['text'][i].strip()
+        self.line = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        self.x = int(data['left'][i])
+        self.y = int(data['top'][i])
+        self.w = int(data['width'][i])
+        self.h = int(data['height'][i])
+        return self
+
+    def parse_baidu(self, text, location, start, end, length):
+        # baidu reports whole lines, the word spans characters [start, end) of a line of length
+        # characters and gets the matching share of its width
+        self.text = text
+        self.x = int(location['left'] + location['width'] * start / length)
+        self.y = int(location['top'])
+        self.w = max(1, int(location['width'] * (end - start) / length))
+        self.h = int(location['height'])
+        return self
+
     @property
     def top(self):
         return self.y
@@ -148,28 +198,425 @@ class Word:
             return newword
 
 
+def cluster_lines(words, tolerance=20, direction='v'):
+    """
+    Group words into rows ('v') or columns ('h') by sorting on center and sweeping once
+
+    Consecutive words whose centers are no more than tolerance apart share a line, so a line
+    is every word chained to another within tolerance. Rows are returned top to bottom with
+    words left to right, columns left to right with words top to bottom.
+
+    Parameters
+    ----------
+    words: list of Word
+    tolerance: int
+        maximum center distance, in pixels, between neighbouring words of a line
+    direction: str
+        'v' for rows (words aligned vertically), 'h' for columns
+    Returns
+    -------
+    list of list of Word
+    """
+    if direction not in ('h', 'v'):
+        raise ValueError("direction has to be one of ('h', 'v')")
+    axis = 1 if direction == 'v' else 0
+    ordered = sorted(words, key=lambda w: (w.center[axis], w.center[1 - axis], w.text))
+    lines = []
+    last = None
+    for word in ordered:
+        coord = word.center[axis]
+        if last is None or coord - last > tolerance:
+            lines.append([])
+        lines[-1].append(word)
+        last = coord
+    return [sorted(line, key=lambda w: (w.center[1 - axis], w.center[axis], w.text)) for line in lines]
+
+
+def cluster_rows(words, tolerance=20):
+    return cluster_lines(words, tolerance=tolerance, direction='v')
+
+
+def join_words(words):
+    # single word spanning the given words, texts joined left to right
+    words = sorted(words, key=lambda w: (w.left, w.top))
+    newword = Word()
+    newword.text = " ".join([word.text for word in words])
+    newword.x = min(word.left for word in words)
+    newword.y = min(word.top for word in words)
+    newword.w = max(word.right for word in words) - newword.x
+    newword.h = max(word.bottom for word in words) - newword.y
+    return newword
+
+
+class TableRow:
+    """
+    One row of an extracted table
+
+    `cells` maps a column name to the words of that cell, left to right. The usual columns are
+    available as attributes (row.name, row.time, ...) which join the cell words into one Word,
+    or give None when the row has no such cell.
+    """
+    FIELDS = ('name', 'time', 'position', 'tier', 'status')
+    __slots__ = ('cells', 'words')
+
+    def __init__(self, cells, words):
+        self.cells = cells
+        self.words = words
+
+    def __repr__(self):
+        return f"TableRow({ {field: self.get(field).text for field in self.cells} })"
+
+    def __getattr__(self, field):
+        if field in TableRow.FIELDS:
+            return self.get(field)
+        raise AttributeError(field)
+
+    def get(self, field):
+        if field not in self.cells:
+            return None
+        return join_words(self.cells[field])
+
+    @property
+    def top(self):
+        return min(word.top for word in self.words)
+
+    @property
+    def bottom(self):
+        return max(word.bottom for word in self.words)
+
+
+def column_bands(headers):
+    """
+    Column bands from header words, each column spans halfway to its neighbouring headers
+
+    Parameters
+    ----------
+    headers: dict
+        column name -> header Word
+    Returns
+    -------
+    (names, edges)
+        column names left to right and the len(names) + 1 band edges in pixels
+    """
+    ordered = sorted(headers.items(), key=lambda item: item[1].center[0])
+    names = [name for name, _ in ordered]
+    centers = [word.center[0] for _, word in ordered]
+    if len(centers) == 1:
+        word = ordered[0][1]
+        return names, [word.left - word.w, word.right + word.w]
+    mids = [(a + b) / 2 for a, b in zip(centers, centers[1:])]
+    edges = [centers[0] - (mids[0] - centers[0])] + mids + [centers[-1] + (centers[-1] - mids[-1])]
+    return names, edges
+
+
+def extract_table(words, headers=None, classify=None, top=None, bottom=None, tolerance=None):
+    """
+    Split words into table rows and columns in one sort and sweep
+
+    Rows are word lines clustered with a tolerance of 0.8 word height. Columns come from the
+    header words, or from classify(word) when the table has no header. Nothing depends on
+    pixel constants, so the same call works at any frame resolution.
+
+    Parameters
+    ----------
+    words: list of Word
+    headers: dict
+        column name -> header Word, words outside every column band are dropped
+    classify: callable
+        word -> column name, or None to drop the word, used when headers is None
+    top, bottom: float
+        rows are taken between these y positions, words cut by either edge
+        (within half a word height of it) are dropped
+    tolerance: float
+        row clustering tolerance in pixels, defaults to 0.8 median word height
+    Returns
+    -------
+    list of TableRow
+        top to bottom
+    """
+    if (headers is None) == (classify is None):
+        raise ValueError("one of (headers, classify) must be None")
+    if not words:
+        return []
+    half_height = np.median([word.h for word in words]) / 2
+    if top is not None:
+        words = [word for word in words if word.top >= top + half_height]
+    if bottom is not None:
+        words = [word for word in words if word.bottom <= bottom - half_height]
+    if tolerance is None:
+        tolerance = 1.6 * half_height
+    if headers is not None:
+        names, edges = column_bands(headers)
+
+    rows = []
+    for line in cluster_rows(words, tolerance=tolerance):
+        cells = {}
+        kept = []
+        for word in line:
+            if headers is not None:
+                i = bisect_right(edges, word.center[0]) - 1
+                field = names[i] if 0 <= i < len(names) else None
+            else:
+                field = classify(word)
+            if field is None:
+                continue
+            cells.setdefault(field, []).append(word)
+            kept.append(word)
+        if kept:
+            rows.append(TableRow(cells, kept))
+    return rows
+
+
+class WordTable:
+    """
+    Columnar copy of a word list, geometry predicates of Word evaluated against every word at once
+
+    Each predicate returns a boolean mask over `words`, with the word list as `self`
+    side of the Word method, e.g. table.left_of(word)[i] == words[i].left_of(word)
+    """
+    def __init__(self, words):
+        self.words = words
+        self.texts = [word.text for word in words]
+        self.x = np.fromiter((word.x for word in words), dtype=np.int32, count=len(words))
+        self.y = np.fromiter((word.y for word in words), dtype=np.int32, count=len(words))
+        self.w = np.fromiter((word.w for word in words), dtype=np.int32, count=len(words))
+        self.h = np.fromiter((word.h for word in words), dtype=np.int32, count=len(words))
+        self.right = self.x + self.w
+        self.bottom = self.y + self.h
+        self.center_x = (self.x + self.w / 2).astype(np.int32)
+        self.center_y = (self.y + self.h / 2).astype(np.int32)
+
+    def __len__(self):
+        return len(self.words)
+
+    def select(self, mask):
+        return [self.words[i] for i in np.flatnonzero(mask)]
+
+    def in_box(self, box):
+        left, top, right, bottom = box
+        return (self.x >= left) & (self.y >= top) & (self.right <= right) & (self.bottom <= bottom)
+
+    def align(self, word, threshold=10, direction='h'):
+        if direction == 'h':
+            return np.abs(self.center_x - word.center[0]) <= threshold
+        if direction == 'v':
+            return np.abs(self.center_y - word.center[1]) <= threshold
+        raise ValueError("direction has to be one of ('h', 'v')")
+
+    def vertex_in_other(self, other):
+        left, top, right, bottom = other.box
+        in_x = [(xs >= left) & (xs <= right) for xs in (self.x, self.right)]
+        in_y = [(ys >= top) & (ys <= bottom) for ys in (self.y, self.bottom)]
+        return (in_x[0] | in_x[1]) & (in_y[0] | in_y[1])
+
+    def other_vertex_in(self, other):
+        mask = np.zeros(len(self), dtype=bool)
+        for vx, vy in (other.topleft, other.topright, other.bottomleft, other.bottomright):
+            mask |= (self.x <= vx) & (vx <= self.right) & (self.y <= vy) & (vy <= self.bottom)
+        return mask
+
+    def overlap(self, word):
+        return self.vertex_in_other(word) | self.other_vertex_in(word)
+
+    def left_of(self, word):
+        return self.right <= word.left
+
+    def right_of(self, word):
+        return self.x >= word.right
+
+    def top_of(self, word):
+        return self.bottom <= word.top
+
+    def bottom_of(self, word):
+        return self.y >= word.bottom
+
+
+class WordIndex:
+    """
+    Grid index over a fixed list of words for box, nearest and alignment queries
+
+    Words are bucketed by top left corner for box queries and by center for nearest queries,
+    centers are also kept sorted along each axis for row/column queries.
+    """
+    def __init__(self, words, cell=64):
+        self.words = words
+        self.cell = cell
+        self.corner_grid = {}
+        self.center_grid = {}
+        for i, word in enumerate(words):
+            self.corner_grid.setdefault(self._cell_of(word.topleft), []).append(i)
+            self.center_grid.setdefault(self._cell_of(word.center), []).append(i)
+        self.by_x = sorted((word.center[0], i) for i, word in enumerate(words))
+        self.by_y = sorted((word.center[1], i) for i, word in enumerate(words))
+        self.x_keys = [x for x, _ in self.by_x]
+        self.y_keys = [y for y, _ in self.by_y]
+        cells = list(self.corner_grid) + list(self.center_grid)
+        if cells:
+            self.cell_bounds = (
+                min(c[0] for c in cells), min(c[1] for c in cells),
+                max(c[0] for c in cells), max(c[1] for c in cells)
+            )
+        else:
+            self.cell_bounds = (0, 0, -1, -1)
+
+    def __len__(self):
+        return len(self.words)
+
+    def _cell_of(self, pt):
+        return int(pt[0] // self.cell), int(pt[1] // self.cell)
+
+    def query_box(self, box):
+        # a word inside the box has its top left corner in one of the cells the box covers
+        left, top, right, bottom = box
+        min_cx, min_cy, max_cx, max_cy = self.cell_bounds
+        cx0 = max(min_cx, int(max(left, min_cx * self.cell) // self.cell))
+        cy0 = max(min_cy, int(max(top, min_cy * self.cell) // self.cell))
+        cx1 = min(max_cx, int(min(right, (max_cx + 1) * self.cell) // self.cell))
+        cy1 = min(max_cy, int(min(bottom, (max_cy + 1) * self.cell) // self.cell))
+        ids = []
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for i in self.corner_grid.get((cx, cy), []):
+                    if self.words[i].in_box(box):
+                        ids.append(i)
+        return [self.words[i] for i in sorted(ids)]
+
+    def nearest(self, pt, exclude=()):
+        # search rings of cells around pt until no closer word can exist
+        px, py = pt
+        ccx, ccy = self._cell_of(pt)
+        min_cx, min_cy, max_cx, max_cy = self.cell_bounds
+        max_radius = max(abs(ccx - min_cx), abs(ccx - max_cx), abs(ccy - min_cy), abs(ccy - max_cy))
+        best = None
+        best_dist = float('inf')
+        for r in range(max_radius + 1):
+            for cx in range(ccx - r, ccx + r + 1):
+                for cy in range(ccy - r, ccy + r + 1):
+                    if max(abs(cx - ccx), abs(cy - ccy)) != r:
+                        continue
+                    for i in self.center_grid.get((cx, cy), []):
+                        word = self.words[i]
+                        if any(word is e for e in exclude):
+                            continue
+                        dist = np.hypot(word.center[0] - px, word.center[1] - py)
+                        if dist < best_dist:
+                            best = word
+                            best_dist = dist
+            if best_dist <= r * self.cell:
+                break
+        return best
+
+    def aligned(self, coord, threshold=10, direction='h'):
+        # direction follows Word.align: 'h' compares center x (a column), 'v' center y (a row)
+        if direction == 'h':
+            keys, ordered = self.x_keys, self.by_x
+        elif direction == 'v':
+            keys, ordered = self.y_keys, self.by_y
+        else:
+            raise ValueError("direction has to be one of ('h', 'v')")
+        lo = bisect_left(keys, coord - threshold)
+        hi = bisect_right(keys, coord + threshold)
+        return [self.words[i] for _, i in ordered[lo:hi]]
+
+
 class OCRResult:
     def __init__(self, d, raw=None):
         self.d = d
         self.raw = raw
         self.res = {}
+        self._words = []
+        # WordTable of the words, built by the first use of table
+        self._table = None
+        self.index = WordIndex([])
+        # fractional (left, top, right, bottom) boxes that were OCRed, None for the full screen
+        self.rois = None
+        # page class matched by navi.get_current_page, kept so cached results skip classification
+        self.page_class = None
+        # page class seen on a near identical frame, checked first by navi.get_current_page
+        self.page_hint = None
+        # (width, height) of the OCRed frame, None when unknown
+        self.size = None
+        # returns the OCR result of the whole frame, set on results of regions only; called by
+        # the first lookup that goes outside the regions, see expand
+        self.full_frame = None
        
-    def parse_raw_ocrspace(self):
+    def set_words(self, words):
         indexed = {}
-        for line in self.raw['TextOverlay']['Lines']:
-            for w in line['Words']:
-                word = Word().parse_ocrspace(w)
-                key = word.text.lower()
-                if key not in indexed:
-                    indexed[key] = [word]
-                else:
-                    indexed[key].append(word)
+        for word in words:
+            key = word.text.lower()
+            if key not in indexed:
+                indexed[key] = [word]
+            else:
+                indexed[key].append(word)
         self.res = indexed
+        self._words = [word for word_list in indexed.values() for word in word_list]
+        self._table = None
+        self.index = WordIndex(self._words)
         return self
+
+    def expand(self):
+        """Swap the words of the OCRed regions for those of the whole frame, once"""
+        if self.full_frame is None:
+            return self
+        full_frame, self.full_frame = self.full_frame, None
+        full = full_frame()
+        self.raw = full.raw
+        self.rois = full.rois
+        self.size = full.size or self.size
+        return self.set_words(full.words)
+
+    def covers(self, box):
+        # whether pixel box lies inside the OCRed regions, all words in it are known
+        if self.rois is None:
+            return True
+        if self.size is None:
+            return False
+        width, height = self.size
+        return any(box_in_box(box, roi_to_pixels(roi, width, height)) for roi in self.rois)
+
+    def copy(self):
+        # independent result with copies of the words, e.g. handed out by a cache
+        new = OCRResult(self.d, raw=self.raw).set_words([word.copy() for word in self._words])
+        new.rois = None if self.rois is None else list(self.rois)
+        new.page_class = self.page_class
+        new.page_hint = self.page_hint
+        new.size = self.size
+        return new
+
+    def parse_raw_ocrspace(self):
+        words = []
+        for line in self.raw['TextOverlay']['Lines']:
+            for w in line['Words']:
+                words.append(Word().parse_ocrspace(w))
+        return self.set_words(words)
+
+    def parse_raw_tesseract(self, min_conf=10):
+        # output of pytesseract.image_to_data with output_type=Output.DICT
+        words = []
+        for i, text in enumerate(self.raw['text']):
+            if not text.strip() or float(self.raw['conf'][i]) < min_conf:
+                continue
+            words.append(Word().parse_tesseract(self.raw, i))
+        return self.set_words(words)
     
+    def parse_raw_baidu(self):
+        words = []
+        for i, line in enumerate(self.raw['words_result']):
+            text = line['words']
+            for match in re.finditer(r'\S+', text):
+                word = Word().parse_baidu(match.group(), line['location'], match.start(), match.end(), len(text))
+                word.line = i
+                words.append(word)
+        return self.set_words(words)
+
+    def has_word(self, word):
+        # whether word was read, without OCRing the rest of the frame
+        return word.lower() in self.res
+
     def word_exists(self, word):
-        word = word.lower()
-        return word in self.res
+        # a word found in the OCRed regions may also be elsewhere on the frame, read it all
+        self.expand()
+        return word.lower() in self.res
     
     @property
     def keys(self):
@@ -177,10 +624,16 @@ class OCRResult:
     
     @property
     def words(self):
-        words = []
-        for word_list in self.res.values():
-            words.extend(word_list)
-        return words
+        self.expand()
+        return self._words
+
+    @property
+    def table(self):
+        # vectorized geometry predicates over words, e.g. table.select(table.in_box(box))
+        self.expand()
+        if self._table is None:
+            self._table = WordTable(self._words)
+        return self._table
     
     def get_word(self, word):
         word = word.lower()
@@ -190,11 +643,20 @@ class OCRResult:
             return []
     
     def get_words_in_box(self, box):
-        res_list = []
-        for word in self.words:
-            if word.in_box(box):
-                res_list.append(word)
-        return res_list
+        if not self.covers(box):
+            self.expand()
+        return self.index.query_box(box)
+
+    def get_nearest_word(self, loc, exclude=()):
+        self.expand()
+        return self.index.nearest(loc, exclude=exclude)
+
+    def get_aligned_words(self, word, threshold=10, direction='h'):
+        # words whose center is within threshold of word's center column ('h') or row ('v')
+        center = word.center if isinstance(word, Word) else word
+        coord = center[0] if direction == 'h' else center[1]
+        self.expand()
+        return self.index.aligned(coord, threshold=threshold, direction=direction)
         
     def num_occurrences(self, word):
         word = word.lower()
@@ -204,18 +666,13 @@ class OCRResult:
             return 0
         
     def handle_location(self, loc):
-        new_loc = [int(i) for i in loc]
-        if min(new_loc) < 0:
-            w, h = self.d.window_size()
-            if new_loc[0] < 0:
-                new_loc[0] += w
-            if new_loc[1] < 0:
-                new_loc[1] += h
-            
-        return new_loc
+        # loc is on the OCRed frame: pixels, screen fractions or offsets from the far edges,
+        # see geometry.resolve_location; returns device pixels
+        return get_geometry(self.d).to_device(loc, self.size)
     
     def get_center(self, word, occurrence=0):
         word = word.lower()
+        self.word_exists(word)
         return self.res[word][occurrence].center
     
     def click(self, word=None, occurrence=0, loc=None):
@@ -233,10 +690,15 @@ class OCRResult:
         LOG.info(f'Clicking {loc}')
         self.d.click(*loc)
        
-    def repeat_click(self, word=None, occurrence=0, loc=None, num_clicks=1, delay=3):
+    def repeat_click(self, word=None, occurrence=0, loc=None, num_clicks=1, delay=3, wait=None):
+        # wait: called after each click instead of sleeping delay seconds, e.g.
+        # ScreenChangeDetector.wait_settled to continue as soon as the screen has reacted
         for i in range(num_clicks):
             self.click(word=word, occurrence=occurrence, loc=loc)
-            time.sleep(delay)
+            if wait is None:
+                time.sleep(delay)
+            else:
+                wait()
     
     def drag(self, word1=None, word2=None, occurrence1=0, occurrence2=0, loc1=None, loc2=None, duration=1):
         if ((word1 is None) == (loc1 is None)) or ((word2 is None) == (loc2 is None)):
@@ -1,18 +1,21 @@
+from functools import lru_cache
 import ocrspace
-from pathlib import Path
-from PIL import Image
-import numpy as np
 import cv2
 import logging
-from .utils import read_yaml_file, showimg
-from .ocrprocessing import OCRResult, Word
+from .utils import showimg
+from .credentials import CREDENTIALS
+from .ocrprocessing import OCRResult, roi_to_pixels
+from .framesource import get_frame_source, encode_frame, to_rgb
+from . import batchocr
 
 LOG = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+@lru_cache(maxsize=None)
 def get_api_endpoint(OCREngine=1, isOverlayRequired=True, isTable='true', **kwargs):
+    # one endpoint per set of options, the key file is read once
     api = ocrspace.API(
-        read_yaml_file('config/ocrspaceapi.yml')['key'], 
+        CREDENTIALS.config('config/ocrspaceapi.yml')['key'], 
         OCREngine=OCREngine, 
         isOverlayRequired=isOverlayRequired, 
         isTable=isTable,
@@ -20,19 +23,86 @@ def get_api_endpoint(OCREngine=1, isOverlayRequired=True, isTable='true', **kwar
     )
     return api
 
-    
-def screenshot_ocr(d, api, show=False):
-    d.screenshot(Path(__file__).absolute().parent.parent.joinpath('screenshots/current.png'))
-    res = api.ocr_file('screenshots/current.png')
-    ss_img = np.array(Image.open('screenshots/current.png'))
-    if show:
-        for i, line in enumerate(res['TextOverlay']['Lines']):
-            for word_res in line['Words']:
-                word = Word().parse_ocrspace(word_res)
 
-                # Visualize bbox
-                cv2.rectangle(ss_img, (word.left, word.top), (word.right, word.bottom), (0, 255, 0), 2)
-                cv2.putText(ss_img, word.text, (word.center), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+class OCRSpaceEngine:
+    name = 'ocrspace'
+
+    def __init__(self, api):
+        self.api = api
+
+    def recognize(self, img):
+        return self.api.ocr_file(encode_frame(img))
+
+    def parse(self, d, raw):
+        return OCRResult(d, raw=raw).parse_raw_ocrspace()
+
+
+def as_engine(api):
+    # plain ocrspace.API objects are still accepted everywhere an engine is
+    if isinstance(api, ocrspace.API):
+        return OCRSpaceEngine(api)
+    return api
+
 
-        showimg(ss_img)
-    return ss_img, OCRResult(d, raw=res).parse_raw_ocrspace()
+def ocr_frame(d, api, img, rois=None, cache=None):
+    """
+    OCR a BGR frame, or only the given regions of it
+
+    Parameters
+    ----------
+    d: uiautomator2 device used by the result to click
+    api: OCR engine or ocrspace.API
+    img: np.ndarray
+        BGR frame
+    rois: list of tuple
+        fractional (left, top, right, bottom) boxes, tiled onto one canvas and read with a
+        single request; words are mapped back to frame coordinates
+    cache: screencache.OCRCache
+        results of the exact same frame are reused instead of calling the engine, near
+        identical frames only pass on their page class as page_hint
+    Returns
+    -------
+    OCRResult
+    """
+    if cache is not None:
+        ocrr = cache.get(img, rois=rois)
+        if ocrr is not None:
+            LOG.debug('Screen unchanged, reusing OCR result')
+            ocrr.d = d
+            return ocrr
+        ocrr = ocr_frame(d, api, img, rois=rois)
+        ocrr.page_hint = cache.page_class(img)
+        return cache.put(img, ocrr, rois=rois)
+
+    engine = as_engine(api)
+    h, w = img.shape[:2]
+    if rois is None:
+        ocrr = engine.parse(d, engine.recognize(img))
+        ocrr.size = (w, h)
+        return ocrr
+
+    return batchocr.ocr_batch(d, engine, [img], rois=rois)[0]
+
+
+def show_ocr(img, ocrr):
+    ss_img = to_rgb(img)
+    h, w = img.shape[:2]
+    for roi in ocrr.rois or []:
+        left, top, right, bottom = roi_to_pixels(roi, w, h)
+        cv2.rectangle(ss_img, (left, top), (right, bottom), (255, 0, 0), 2)
+    for word in ocrr.words:
+        # Visualize bbox
+        cv2.rectangle(ss_img, (word.left, word.top), (word.right, word.bottom), (0, 255, 0), 2)
+        cv2.putText(ss_img, word.text, (word.center), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 0), 2)
+    showimg(ss_img)
+    return ss_img
+
+
+def screenshot_ocr(d, api, show=False, source=None, rois=None, cache=None):
+    img = get_frame_source(d, source).get_frame()
+    ocrr = ocr_frame(d, api, img, rois=rois, cache=cache)
+    if show:
+        ss_img = show_ocr(img, ocrr)
+    else:
+        ss_img = to_rgb(img)
+    return ss_img, ocrr
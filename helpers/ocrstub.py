@@ -0,0 +1,87 @@
+"""
+Local stand-in for the OCR.space service
+
+    python -m helpers.ocrstub --port 8089 --latency 0.3 --fail-every 5
+
+then point the async engine at it, e.g. in config/ocr.yml
+    engine: ocrspace_async
+    ocrspace_async:
+        endpoint: http://127.0.0.1:8089/parse/image
+"""
+import argparse
+import asyncio
+from aiohttp import web
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_WORDS = [('Club', 120, 60, 90, 32), ('Members', 220, 60, 160, 32)]
+
+
+def ocrspace_response(words):
+    """OCR.space style response with one line per word, words are (text, left, top, width, height)"""
+    lines = [
+        {'LineText': text, 'Words': [{'WordText': text, 'Left': x, 'Top': y, 'Width': w, 'Height': h}]}
+        for text, x, y, w, h in words
+    ]
+    return {
+        'ParsedResults': [{
+            'TextOverlay': {'Lines': lines, 'HasOverlay': True},
+            'ParsedText': '\n'.join(text for text, *_ in words),
+            'FileParseExitCode': 1,
+        }],
+        'OCRExitCode': 1,
+        'IsErroredOnProcessing': False,
+    }
+
+
+def make_app(words=None, latency=0.0, fail_every=0):
+    """
+    Parameters
+    ----------
+    words: list of tuple or callable
+        (text, left, top, width, height) returned for every image, or a function of the
+        uploaded file's bytes returning them
+    latency: float
+        seconds each request takes
+    fail_every: int
+        every fail_every-th request is answered with HTTP 503, 0 never fails
+    """
+    app = web.Application(client_max_size=10 * 2 ** 20)
+    app['stats'] = {'requests': 0, 'failed': 0, 'in_flight': 0, 'max_in_flight': 0}
+    words = DEFAULT_WORDS if words is None else words
+
+    async def parse_image(request):
+        stats = request.app['stats']
+        stats['requests'] += 1
+        stats['in_flight'] += 1
+        stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+        try:
+            form = await request.post()
+            if 'file' not in form or 'apikey' not in form:
+                return web.json_response('No file or apikey in request', status=400)
+            await asyncio.sleep(latency)
+            if fail_every and stats['requests'] % fail_every == 0:
+                stats['failed'] += 1
+                return web.Response(status=503)
+            found = words(form['file'].file.read()) if callable(words) else words
+            return web.json_response(ocrspace_response(found))
+        finally:
+            stats['in_flight'] -= 1
+
+    async def stats(request):
+        return web.json_response(request.app['stats'])
+
+    app.router.add_post('/parse/image', parse_image)
+    app.router.add_get('/stats', stats)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--fail-every', type=int, default=0)
+    args = parser.parse_args()
+    web.run_app(make_app(latency=args.latency, fail_every=args.fail_every), host='127.0.0.1', port=args.port)
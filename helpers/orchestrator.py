@@ -0,0 +1,223 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+import re
+import time
+import traceback
+import cv2
+import pandas as pd
+import uiautomator2 as u2
+import logging
+from naive_scrcpy_client.NaiveScrcpyClient import NaiveScrcpyClient
+from .framesource import DeviceFrameSource, ScrcpyFrameSource
+from .scrcpyinput import get_input
+from .geometry import get_geometry
+from .screencache import OCRCache
+from . import simple_bot
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class PooledEngine:
+    """
+    OCR engine whose recognize calls run on a shared, bounded thread pool
+
+    Sessions keep calling recognize synchronously; at most max_workers requests are in flight
+    across all of them, the others queue up in the pool.
+    """
+    def __init__(self, engine, executor):
+        self.engine = engine
+        self.executor = executor
+        self.name = getattr(engine, 'name', type(engine).__name__)
+
+    def recognize(self, img):
+        return self.executor.submit(self.engine.recognize, img).result()
+
+    def parse(self, d, raw):
+        return self.engine.parse(d, raw)
+
+
+class DeviceSession:
+    """
+    Everything one device needs to run a bot task next to others
+
+    Parameters
+    ----------
+    serial: str
+        adb serial of the device
+    api: OCR engine, usually a PooledEngine shared by all sessions
+    port: int
+        local port the scrcpy stream of this device is forwarded to
+    scrcpy: dict
+        NaiveScrcpyClient config, adb_device and adb_port are filled in per device;
+        screenshots are taken through uiautomator2 when None
+    scratch_root: str
+        per device scratch directories are created below it
+    input_backend: str
+        'u2' or 'scrcpy', see scrcpyinput.get_input; 'scrcpy' needs a scrcpy config
+    """
+    def __init__(self, serial, api, port=61550, scrcpy=None, scratch_root='scratch', input_backend='u2'):
+        self.serial = serial
+        self.api = api
+        self.port = port
+        self.scrcpy = scrcpy
+        self.input_backend = input_backend
+        self.scratch = Path(scratch_root).joinpath(re.sub(r'[^\w.-]', '_', serial))
+        # screens differ between accounts, each device keeps its own OCR cache
+        self.cache = OCRCache(maxsize=64, threshold=6)
+        self.d = None
+        self.geometry = None
+        self.client = None
+        self.source = None
+        self.status = 'pending'
+        self.step = None
+        self.error = None
+        self.started = None
+        self.finished = None
+
+    def __repr__(self):
+        return f"DeviceSession({self.serial}, {self.status}, {self.step})"
+
+    def open(self):
+        self.scratch.mkdir(parents=True, exist_ok=True)
+        self.d = u2.connect(self.serial)
+        if self.scrcpy is not None:
+            config = dict(self.scrcpy, adb_device=self.serial, adb_port=self.port)
+            self.client = NaiveScrcpyClient(config)
+            if self.client.start_loop():
+                raise ConnectionError(f'Could not start scrcpy on {self.serial} port {self.port}')
+            self.source = ScrcpyFrameSource(self.client)
+        else:
+            self.source = DeviceFrameSource(self.d)
+        self.d = get_input(self.d, self.client, self.input_backend)
+        # screen size is asked once per session, again only when scrcpy sees the screen rotate
+        self.geometry = get_geometry(self.d, self.client)
+
+    def close(self):
+        if self.client is not None:
+            self.client.stop_loop()
+            self.client = None
+
+    def report(self, step):
+        self.step = step
+        LOG.info(f'[{self.serial}] {step}')
+
+    def save_frame(self, name):
+        # last screen of the device for debugging, kept in its own scratch directory
+        try:
+            img = self.source.get_frame()
+        except Exception:
+            return None
+        file = self.scratch.joinpath(f'{name}.png')
+        cv2.imwrite(str(file), img)
+        return file
+
+    def run(self, task):
+        self.status = 'running'
+        self.started = time.time()
+        try:
+            self.open()
+            task(self)
+            self.status = 'done'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = repr(e)
+            LOG.error(f'[{self.serial}] failed at {self.step}: {e}\n{traceback.format_exc()}')
+            if self.source is not None:
+                self.save_frame('failed')
+        finally:
+            self.close()
+            self.finished = time.time()
+        return self.status
+
+    def progress(self):
+        end = self.finished or time.time()
+        return {
+            'serial': self.serial,
+            'status': self.status,
+            'step': self.step,
+            'elapsed': None if self.started is None else end - self.started,
+            'cache_hits': self.cache.hits,
+            'error': self.error,
+        }
+
+
+def club_task(session, show=False):
+    """Start the game, open the club member list and add everyone as friend"""
+    kwargs = dict(show=show, source=session.source, api=session.api, cache=session.cache)
+    session.report('starting game')
+    if not simple_bot.start_game(session.d, **kwargs):
+        raise RuntimeError('Game did not reach the home page')
+    session.report('entering club members page')
+    simple_bot.enter_club_members_page(session.d, **kwargs)
+    session.report('adding friends')
+    simple_bot.add_friends(session.d, **kwargs)
+
+
+class Orchestrator:
+    """
+    Runs a bot task on several devices at once
+
+    Each device gets its own thread, scrcpy port, frame source, OCR cache and scratch
+    directory; OCR requests of all devices share one pool of ocr_workers threads so the OCR
+    service is never hit by more than that many requests at a time.
+
+    Parameters
+    ----------
+    serials: list of str
+        adb serials of the devices
+    task: callable
+        task(session) run for every device, see club_task
+    engine: OCR engine
+        defaults to the engine of simple_bot
+    ocr_workers: int
+        maximum number of concurrent OCR requests
+    scrcpy: dict
+        NaiveScrcpyClient config shared by all devices, None to use uiautomator2 screenshots
+    base_port: int
+        scrcpy ports are base_port, base_port + 1, ...
+    scratch_root: str
+        per device scratch directories are created below it
+    input_backend: str
+        'u2' or 'scrcpy' to send taps and drags over the scrcpy connection
+    """
+    def __init__(self, serials, task=club_task, engine=None, ocr_workers=4, scrcpy=None,
+                 base_port=61550, scratch_root='scratch', input_backend='u2'):
+        self.task = task
+        self.ocr_pool = ThreadPoolExecutor(max_workers=ocr_workers, thread_name_prefix='ocr')
+        self.api = PooledEngine(simple_bot.API if engine is None else engine, self.ocr_pool)
+        self.sessions = [
+            DeviceSession(
+                serial, self.api, port=base_port + i, scrcpy=scrcpy, scratch_root=scratch_root,
+                input_backend=input_backend
+            )
+            for i, serial in enumerate(serials)
+        ]
+
+    def progress(self):
+        return pd.DataFrame([session.progress() for session in self.sessions]).set_index('serial')
+
+    def log_progress(self):
+        counts = pd.Series([session.status for session in self.sessions]).value_counts().to_dict()
+        LOG.info(f'Progress {counts}: ' + ', '.join(
+            f'{session.serial} {session.step or session.status}' for session in self.sessions))
+
+    def run(self, report_every=30):
+        """
+        Run the task on all devices and wait for them to finish
+
+        Progress is logged every report_every seconds.
+
+        Returns
+        -------
+        pd.DataFrame
+            final status of every device
+        """
+        with ThreadPoolExecutor(max_workers=len(self.sessions), thread_name_prefix='device') as devices:
+            futures = [devices.submit(session.run, self.task) for session in self.sessions]
+            pending = futures
+            while pending:
+                _, pending = wait(pending, timeout=report_every)
+                self.log_progress()
+        self.ocr_pool.shutdown()
+        return self.progress()
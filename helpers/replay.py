@@ -0,0 +1,368 @@
+"""
+Record a bot session once, replay it without a device or OCR service
+
+Recording wraps the scrcpy client, the device and the OCR engine of a session:
+
+    recorder = SessionRecorder()
+    recorder.attach(client)                   # before client.start_loop()
+    d = RecordingDevice(d, recorder)
+    api = RecordingEngine(simple_bot.API, recorder)
+    simple_bot.enter_club_members_page(d, source=ScrcpyFrameSource(client), api=api)
+    recorder.save('sessions/club.zip')
+
+Replaying streams the recorded H.264 bytes through a local stand-in server into the same
+decoder and answers OCR requests from the recording:
+
+    with Replay('sessions/club.zip', scrcpy_config) as replay:
+        simple_bot.enter_club_members_page(replay.d, source=replay.source, api=replay.api)
+        print(replay.report())
+
+    python -m helpers.replay sessions/club.zip
+"""
+import argparse
+import hashlib
+import json
+import threading
+import time
+import zipfile
+from pathlib import Path
+import numpy as np
+import logging
+from naive_scrcpy_client.NaiveScrcpyClient import NaiveScrcpyClient
+from .framesource import ScrcpyFrameSource
+from .ocrprocessing import OCRResult, Word
+from .screencache import dhash, hamming
+from .scrcpystub import FakeScrcpyServer
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def frame_key(img):
+    # exact key of a frame or crop, replayed frames decode to the same bytes
+    return hashlib.sha1(np.ascontiguousarray(img).tobytes()).hexdigest()
+
+
+def dump_words(words):
+    return [[w.text, list(w.line) if isinstance(w.line, tuple) else w.line, w.x, w.y, w.w, w.h] for w in words]
+
+
+def load_words(rows):
+    words = []
+    for text, line, x, y, w, h in rows:
+        word = Word()
+        word.text = text
+        word.line = tuple(line) if isinstance(line, list) else line
+        word.x, word.y, word.w, word.h = x, y, w, h
+        words.append(word)
+    return words
+
+
+class SessionRecorder:
+    """
+    Collects the stream, OCR responses and input of a session and saves them as one zip file
+
+    The file holds the raw H.264 stream (video.h264) with the arrival time of each chunk, the
+    OCR responses keyed by the hashes of the images sent, and the taps and drags issued.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.lock = threading.Lock()
+        self.meta = {'recorded_at': self.start}
+        self.video = []
+        self.ocr = []
+        self.actions = []
+
+    def __repr__(self):
+        return (
+            f"SessionRecorder({sum(len(data) for _, data in self.video)} video bytes, "
+            f"{len(self.ocr)} OCR responses, {len(self.actions)} actions)"
+        )
+
+    def attach(self, client):
+        """Record the stream of a NaiveScrcpyClient, call before its start_loop"""
+        client.recorder = self
+
+    def header(self, device_name, width, height):
+        with self.lock:
+            self.meta['device_name'] = device_name.strip('\x00')
+            self.meta['frame_size'] = [width, height]
+            self.meta['connected'] = time.time() - self.start
+
+    def video_data(self, data):
+        with self.lock:
+            self.video.append((time.time() - self.start, bytes(data)))
+
+    def ocr_response(self, img, raw, words):
+        entry = {
+            'key': frame_key(img),
+            'dhash': format(dhash(img), 'x'),
+            'shape': list(img.shape[:2]),
+            'raw': raw,
+            'words': dump_words(words),
+            't': time.time() - self.start,
+        }
+        with self.lock:
+            self.ocr.append(entry)
+
+    def action(self, name, *args):
+        with self.lock:
+            self.actions.append({'action': name, 'args': [float(a) for a in args], 't': time.time() - self.start})
+
+    def save(self, file):
+        file = Path(file)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock:
+            self.meta['duration'] = time.time() - self.start
+            chunks = [[t, len(data)] for t, data in self.video]
+            with zipfile.ZipFile(file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr('meta.json', json.dumps(self.meta))
+                archive.writestr('video.h264', b''.join(data for _, data in self.video))
+                archive.writestr('video.json', json.dumps(chunks))
+                # raw responses are JSON already, anything else is kept as text
+                archive.writestr('ocr.json', json.dumps(self.ocr, default=str))
+                archive.writestr('actions.json', json.dumps(self.actions))
+        LOG.info(f'Saved {self} to {file}')
+        return file
+
+
+class Cassette:
+    """A session saved by SessionRecorder"""
+    def __init__(self, file):
+        self.file = Path(file)
+        with zipfile.ZipFile(self.file) as archive:
+            self.meta = json.loads(archive.read('meta.json'))
+            stream = archive.read('video.h264')
+            chunks = json.loads(archive.read('video.json'))
+            self.ocr = json.loads(archive.read('ocr.json'))
+            self.actions = json.loads(archive.read('actions.json'))
+        # chunk times count from the connection, as the stand-in server sends them
+        connected = self.meta.get('connected', 0)
+        self.video = []
+        offset = 0
+        for t, length in chunks:
+            self.video.append((max(0, t - connected), stream[offset:offset + length]))
+            offset += length
+        self.by_key = {}
+        for entry in self.ocr:
+            entry['dhash'] = int(entry['dhash'], 16)
+            self.by_key.setdefault(entry['key'], entry)
+
+    def __repr__(self):
+        return f"Cassette({self.file}, {len(self.video)} chunks, {len(self.ocr)} OCR responses)"
+
+    def lookup(self, img, threshold=None):
+        """
+        Recorded OCR response of the exact same image
+
+        With threshold, an image not recorded gets the response of the most similar recorded
+        one of the same size within threshold hash bits; that response may hold other words
+        than the image shows, so each such match is logged. Returns None when nothing matches.
+        """
+        entry = self.by_key.get(frame_key(img))
+        if entry is not None or threshold is None:
+            return entry
+        value = dhash(img)
+        shape = list(img.shape[:2])
+        best, best_distance = None, threshold + 1
+        for entry in self.ocr:
+            if entry['shape'] != shape:
+                continue
+            distance = hamming(value, entry['dhash'])
+            if distance < best_distance:
+                best, best_distance = entry, distance
+        if best is not None:
+            LOG.warning(f"Replaying the OCR response of a similar image ({best_distance} hash bits off, recorded at {best['t']:.1f}s)")
+        return best
+
+
+class RecordingEngine:
+    """OCR engine recording every response of the engine it wraps"""
+    def __init__(self, engine, recorder):
+        self.engine = engine
+        self.recorder = recorder
+        self.name = getattr(engine, 'name', type(engine).__name__)
+
+    def recognize(self, img):
+        raw = self.engine.recognize(img)
+        self.recorder.ocr_response(img, raw, self.engine.parse(None, raw).words)
+        return raw
+
+    def parse(self, d, raw):
+        return self.engine.parse(d, raw)
+
+
+class ReplayEngine:
+    """
+    OCR engine answering from a cassette
+
+    Parameters
+    ----------
+    cassette: Cassette
+    threshold: int
+        hash bits a replayed frame may differ from the recorded one, for frames picked a
+        little earlier or later than during recording; None answers exact frames only
+    """
+    name = 'replay'
+
+    def __init__(self, cassette, threshold=None):
+        self.cassette = cassette
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+
+    def recognize(self, img):
+        entry = self.cassette.lookup(img, self.threshold)
+        if entry is None:
+            self.misses += 1
+            raise KeyError(f'No recorded OCR response for a {img.shape[1]}x{img.shape[0]} image')
+        self.hits += 1
+        return entry
+
+    def parse(self, d, raw):
+        return OCRResult(d, raw=raw['raw']).set_words(load_words(raw['words']))
+
+
+class RecordingDevice:
+    """uiautomator2 device, or scrcpyinput.ScrcpyInput, recording the taps and drags sent through it"""
+    def __init__(self, d, recorder):
+        self.d = d
+        self.recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self.d, name)
+
+    def window_size(self):
+        size = self.d.window_size()
+        self.recorder.meta['window_size'] = list(size)
+        return size
+
+    def click(self, x, y):
+        self.recorder.action('click', x, y)
+        self.d.click(x, y)
+
+    def drag(self, sx, sy, ex, ey, duration=0.5):
+        self.recorder.action('drag', sx, sy, ex, ey, duration)
+        self.d.drag(sx, sy, ex, ey, duration)
+
+    def swipe(self, sx, sy, ex, ey, duration=0.1):
+        self.recorder.action('swipe', sx, sy, ex, ey, duration)
+        self.d.swipe(sx, sy, ex, ey, duration)
+
+
+class ReplayDevice:
+    """Stands in for the device during a replay, input is only collected"""
+    def __init__(self, cassette):
+        self.cassette = cassette
+        self.start = time.time()
+        self.actions = []
+
+    def __repr__(self):
+        return f"ReplayDevice({len(self.actions)} actions)"
+
+    def window_size(self):
+        return tuple(self.cassette.meta.get('window_size') or self.cassette.meta['frame_size'])
+
+    def session(self, *args, **kwargs):
+        return self
+
+    def app_start(self, *args, **kwargs):
+        pass
+
+    def _action(self, name, *args):
+        self.actions.append({'action': name, 'args': [float(a) for a in args], 't': time.time() - self.start})
+
+    def click(self, x, y):
+        self._action('click', x, y)
+
+    def drag(self, sx, sy, ex, ey, duration=0.5):
+        self._action('drag', sx, sy, ex, ey, duration)
+
+    def swipe(self, sx, sy, ex, ey, duration=0.1):
+        self._action('swipe', sx, sy, ex, ey, duration)
+
+
+class Replay:
+    """
+    Replays a cassette through a FakeScrcpyServer and a real NaiveScrcpyClient
+
+    Use replay.d, replay.source and replay.api in place of the device, frame source and
+    engine of a live session.
+
+    Parameters
+    ----------
+    file: str
+        cassette saved by SessionRecorder
+    config: dict
+        NaiveScrcpyClient config, e.g. lib_path, color_mode; the port and server are set here
+    speed: float
+        stream replay speed, 0 sends the whole stream at once
+    threshold: int
+        see ReplayEngine
+    """
+    def __init__(self, file, config=None, speed=1.0, threshold=None):
+        self.cassette = Cassette(file)
+        self.config = dict(config or {})
+        self.speed = speed
+        self.api = ReplayEngine(self.cassette, threshold)
+        self.d = ReplayDevice(self.cassette)
+        self.server = None
+        self.client = None
+        self.source = None
+        self.started = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self, timeout=10):
+        meta = self.cassette.meta
+        self.server = FakeScrcpyServer(
+            size=tuple(meta['frame_size']), name=meta.get('device_name', 'Replay'),
+            video=self.cassette.video, speed=self.speed
+        ).start()
+        self.client = NaiveScrcpyClient(dict(self.config, adb_port=self.server.port, launch_server=False))
+        if self.client.start_loop():
+            raise ConnectionError(f'Could not connect to the replay server on port {self.server.port}')
+        if self.client.wait_for_frame(0, timeout=timeout) is None:
+            raise RuntimeError(f'No frame decoded from {self.cassette.file} within {timeout}s')
+        self.source = ScrcpyFrameSource(self.client)
+        self.started = time.time()
+        self.d.start = self.started
+        return self
+
+    def stop(self):
+        if self.client is not None:
+            self.client.stop_loop()
+            self.client = None
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def report(self):
+        """How the replayed run compares with the recorded one"""
+        issued = [(a['action'], [round(v) for v in a['args']]) for a in self.d.actions]
+        recorded = [(a['action'], [round(v) for v in a['args']]) for a in self.cassette.actions]
+        return {
+            'elapsed': None if self.started is None else time.time() - self.started,
+            'recorded_duration': self.cassette.meta.get('duration'),
+            'ocr_hits': self.api.hits,
+            'ocr_misses': self.api.misses,
+            'actions': len(issued),
+            'recorded_actions': len(recorded),
+            'same_actions': issued == recorded,
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file')
+    args = parser.parse_args()
+    cassette = Cassette(args.file)
+    print(cassette)
+    print(json.dumps(cassette.meta, indent=2))
+    print(f'{sum(len(data) for _, data in cassette.video)} video bytes over {cassette.video[-1][0] if cassette.video else 0:.1f}s')
+    for action in cassette.actions:
+        print(f"{action['t']:8.2f}s {action['action']} {action['args']}")
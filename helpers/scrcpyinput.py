@@ -0,0 +1,66 @@
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+class ScrcpyInput:
+    """
+    uiautomator2 device whose taps and drags go over the scrcpy control socket
+
+    Clicks and drags are written as touch events on the connection the frames already come
+    from, instead of an HTTP call to the on-device agent for each. Everything else, e.g.
+    session or app_start, is passed on to the uiautomator2 device. Pass it wherever a device
+    is expected, e.g. to ocrspace.ocr_frame, so OCRResult.click and drag use it.
+
+    Coordinates are those of the scrcpy frames, use it together with ScrcpyFrameSource.
+
+    Parameters
+    ----------
+    client: NaiveScrcpyClient
+        running client, see start_loop
+    d: uiautomator2 device
+        handles everything but input, may be None when only input is needed
+    """
+    def __init__(self, client, d=None):
+        self.client = client
+        self.d = d
+
+    def __repr__(self):
+        return f"ScrcpyInput({self.d})"
+
+    def __getattr__(self, name):
+        # only called for attributes not found on ScrcpyInput itself
+        if self.d is None:
+            raise AttributeError(f'{name} needs a uiautomator2 device')
+        return getattr(self.d, name)
+
+    def window_size(self):
+        return self.client.frame_size
+
+    def click(self, x, y):
+        self.client.tap(x, y)
+
+    def drag(self, sx, sy, ex, ey, duration=0.5):
+        self.client.swipe(sx, sy, ex, ey, duration=duration)
+
+    def swipe(self, sx, sy, ex, ey, duration=0.1):
+        self.client.swipe(sx, sy, ex, ey, duration=duration)
+
+
+def get_input(d, client=None, backend='u2'):
+    """
+    Device to hand to the bot for input
+
+    Parameters
+    ----------
+    backend: str
+        'u2' to tap through uiautomator2, 'scrcpy' to tap over the control socket of client
+    """
+    if backend == 'u2':
+        return d
+    if backend == 'scrcpy':
+        if client is None:
+            raise ValueError('The scrcpy input backend needs a running NaiveScrcpyClient')
+        return ScrcpyInput(client, d)
+    raise ValueError(f"Unknown input backend {backend}, use one of ('u2', 'scrcpy')")
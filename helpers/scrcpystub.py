@@ -0,0 +1,172 @@
+"""
+Local stand-in for the scrcpy server, to try the control socket input without a device
+
+    python -m helpers.scrcpystub --port 61550 --size 1280x720
+
+then start a NaiveScrcpyClient on that adb_port (the decoder gets no video) and send input
+through helpers.scrcpyinput.ScrcpyInput; every event received is logged.
+"""
+import argparse
+import socket
+import struct
+import threading
+import time
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# payload length of each fixed size control message, CONTROL_TEXT is length prefixed
+PAYLOAD_LENGTHS = {0: 9, 2: 13, 3: 16, 4: 1}
+ACTIONS = {0: 'down', 1: 'up', 2: 'move'}
+
+
+def parse_message(kind, payload):
+    if kind == 2:
+        action, buttons, x, y, width, height = struct.unpack('>BiHHHH', payload)
+        return {'type': 'touch', 'action': ACTIONS.get(action, action), 'x': x, 'y': y, 'size': (width, height)}
+    if kind == 3:
+        x, y, width, height, h_scroll, v_scroll = struct.unpack('>HHHHii', payload)
+        return {'type': 'scroll', 'x': x, 'y': y, 'size': (width, height), 'h_scroll': h_scroll, 'v_scroll': v_scroll}
+    if kind == 0:
+        action, keycode, meta = struct.unpack('>Bii', payload)
+        return {'type': 'key', 'action': ACTIONS.get(action, action), 'keycode': keycode, 'meta': meta}
+    if kind == 1:
+        return {'type': 'text', 'text': payload.decode('utf-8')}
+    return {'type': 'command', 'command': payload[0]}
+
+
+class FakeScrcpyServer:
+    """
+    Accepts one client at a time, sends the device info a real server sends and records the
+    control messages it receives
+
+    Parameters
+    ----------
+    port: int
+        0 picks a free port, see self.port
+    size: tuple
+        (width, height) of the pretended video stream
+    name: str
+        device name sent to the client
+    video: list of (float, bytes)
+        raw H.264 chunks sent after the device info, each that many seconds after connecting,
+        e.g. a recorded session, see helpers.replay
+    speed: float
+        replay speed of video, 0 sends it all at once
+    """
+    def __init__(self, port=0, size=(1280, 720), name='FakeDevice', video=None, speed=1.0):
+        self.size = size
+        self.name = name
+        self.video = video or []
+        self.speed = speed
+        # set once all of video has been sent to the current client
+        self.video_done = threading.Event()
+        self.events = []
+        self.cond = threading.Condition()
+        self.should_run = True
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(('127.0.0.1', port))
+        self.server.listen(1)
+        self.server.settimeout(0.5)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+
+    def __repr__(self):
+        return f"FakeScrcpyServer(127.0.0.1:{self.port}, {len(self.events)} events)"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.should_run = False
+        self.thread.join()
+        self.server.close()
+
+    def wait_events(self, count, timeout=5):
+        """Block until count events have been received, returns them"""
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.events) >= count, timeout)
+            return list(self.events)
+
+    def _serve(self):
+        while self.should_run:
+            try:
+                conn, _ = self.server.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                conn.sendall(b'\x00' + self.name.encode('utf-8').ljust(64, b'\x00') + struct.pack('>HH', *self.size))
+                self.video_done.clear()
+                threading.Thread(target=self._send_video, args=(conn,), daemon=True).start()
+                self._read_messages(conn)
+
+    def _send_video(self, conn):
+        start = time.time()
+        try:
+            for t, data in self.video:
+                if not self.should_run:
+                    return
+                if self.speed > 0:
+                    delay = start + t / self.speed - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                conn.sendall(data)
+        except OSError as e:
+            LOG.info(f'Client left before the end of the video: {e}')
+            return
+        self.video_done.set()
+
+    def _read_exactly(self, conn, size):
+        data = b''
+        while len(data) < size:
+            try:
+                chunk = conn.recv(size - len(data))
+            except socket.timeout:
+                if not self.should_run:
+                    return None
+                continue
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_messages(self, conn):
+        conn.settimeout(0.5)
+        while self.should_run:
+            header = self._read_exactly(conn, 1)
+            if header is None:
+                return
+            kind = header[0]
+            if kind == 1:
+                length = self._read_exactly(conn, 2)
+                payload = None if length is None else self._read_exactly(conn, struct.unpack('>H', length)[0])
+            elif kind in PAYLOAD_LENGTHS:
+                payload = self._read_exactly(conn, PAYLOAD_LENGTHS[kind])
+            else:
+                LOG.error(f'Unknown control message type {kind}, closing the connection')
+                return
+            if payload is None:
+                return
+            event = dict(parse_message(kind, payload), time=time.time())
+            LOG.debug(f'Received {event}')
+            with self.cond:
+                self.events.append(event)
+                self.cond.notify_all()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=61550)
+    parser.add_argument('--size', default='1280x720')
+    args = parser.parse_args()
+    LOG.setLevel(logging.DEBUG)
+    server = FakeScrcpyServer(args.port, size=tuple(int(v) for v in args.size.split('x'))).start()
+    LOG.info(f'Listening on 127.0.0.1:{server.port}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,118 @@
+from collections import OrderedDict
+import hashlib
+import cv2
+import numpy as np
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def dhash(img, hash_size=16):
+    """
+    Difference hash of a BGR or grayscale frame
+
+    The frame is downscaled to (hash_size + 1) x hash_size and each bit records whether a pixel
+    is brighter than its right neighbour, so compression noise and small shifts barely change it.
+    """
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming(hash1, hash2):
+    return bin(hash1 ^ hash2).count('1')
+
+
+def frame_digest(img):
+    # exact key of a frame, identical pixels only
+    return hashlib.sha1(np.ascontiguousarray(img).tobytes() + str(img.shape).encode()).hexdigest()
+
+
+class OCRCache:
+    """
+    LRU cache of the OCRResults of exact frames, and of the pages seen on similar frames
+
+    A whole result is only reused for a frame with the very same pixels, and callers get a
+    copy of it. Near identical frames, within threshold bits of their perceptual hash, can
+    look the same while names, times or positions differ, so for them only the page class is
+    reused, see page_class.
+
+    Parameters
+    ----------
+    maxsize: int
+        number of screens kept
+    threshold: int
+        maximum number of differing hash bits for two frames to count as the same page
+    hash_size: int
+        side of the downscaled frame, the hash has hash_size ** 2 bits
+    """
+    def __init__(self, maxsize=64, threshold=6, hash_size=16):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.hash_size = hash_size
+        self.entries = OrderedDict()
+        # frame digest: (perceptual hash, page class)
+        self.pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"OCRCache({len(self)}/{self.maxsize} screens, {self.hits} hits, {self.misses} misses)"
+
+    @staticmethod
+    def _rois_key(rois):
+        return None if rois is None else tuple(tuple(roi) for roi in rois)
+
+    @staticmethod
+    def _trim(entries, maxsize):
+        while len(entries) > maxsize:
+            entries.popitem(last=False)
+
+    def get(self, img, rois=None):
+        """Copy of the result of the exact same frame and regions, None if there is none"""
+        key = (frame_digest(img), self._rois_key(rois))
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key].copy()
+
+    def put(self, img, ocrr, rois=None):
+        # a copy is kept, later changes by the caller do not reach the cache
+        key = (frame_digest(img), self._rois_key(rois))
+        self.entries[key] = ocrr.copy()
+        self.entries.move_to_end(key)
+        self._trim(self.entries, self.maxsize)
+        return ocrr
+
+    def remember_page(self, img, page_class):
+        digest = frame_digest(img)
+        self.pages[digest] = (dhash(img, self.hash_size), page_class)
+        self.pages.move_to_end(digest)
+        self._trim(self.pages, self.maxsize)
+
+    def page_class(self, img):
+        """Page class remembered for img or a near identical frame, None if there is none"""
+        digest = frame_digest(img)
+        if digest in self.pages:
+            return self.pages[digest][1]
+        value = dhash(img, self.hash_size)
+        best = None
+        best_dist = self.threshold + 1
+        for page_hash, page_class in self.pages.values():
+            dist = hamming(value, page_hash)
+            if dist < best_dist:
+                best = page_class
+                best_dist = dist
+        return best
+
+    def clear(self):
+        self.entries.clear()
+        self.pages.clear()
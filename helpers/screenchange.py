@@ -0,0 +1,133 @@
+import time
+import cv2
+import logging
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def frame_energy(a, b):
+    # mean absolute difference of two prepared frames, in gray levels
+    return float(cv2.absdiff(a, b).mean())
+
+
+class ScreenChangeDetector:
+    """
+    Waits for the screen to change and settle instead of sleeping for a fixed time
+
+    Frames are compared downscaled and in gray so compression noise and the blinking cursor
+    barely register. A frame is "changed" when it differs from the reference by more than
+    threshold, and the screen is "stable" once consecutive frames stayed below threshold for
+    stable_ms. The reference is the last frame returned, or the one given to mark().
+
+    Parameters
+    ----------
+    source: frame source
+        e.g. framesource.ScrcpyFrameSource; with scrcpy, frames only arrive when the screen
+        changes so waiting costs nothing while the screen is still
+    work_width: int
+        width frames are downscaled to before comparing
+    threshold: float
+        mean absolute gray level difference that counts as a change
+    stable_ms: float
+        how long the screen must not change to count as settled
+    poll: float
+        seconds to wait for a new frame before looking again
+    screenshot_interval: float
+        least seconds between two frames of a source without a stream (frame_seq() is None),
+        each of those frames is a screenshot taken on request
+    """
+    def __init__(self, source, work_width=160, threshold=2.0, stable_ms=300, poll=0.05, screenshot_interval=0.3):
+        self.source = source
+        self.work_width = work_width
+        self.threshold = threshold
+        self.stable_ms = stable_ms
+        self.poll = poll
+        self.screenshot_interval = screenshot_interval
+        self.last_fetch = 0
+        self.img = None
+        self.reference = None
+
+    def prepare(self, img):
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        h, w = img.shape
+        scale = self.work_width / w
+        return cv2.resize(img, (self.work_width, max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+
+    def next_frame(self):
+        seq = self.source.frame_seq()
+        if seq is None:
+            # wait_for_frame returns a new screenshot at once, polling would take them back to back
+            time.sleep(max(0, self.last_fetch + self.screenshot_interval - time.time()))
+        img = self.source.wait_for_frame(seq, timeout=self.poll)
+        self.last_fetch = time.time()
+        return img, self.prepare(img)
+
+    def mark(self, img=None):
+        """Take img (the current frame by default) as the reference for wait_changed"""
+        if img is None:
+            img = self.source.get_frame()
+        self.img = img
+        self.reference = self.prepare(img)
+        return img
+
+    def wait_changed(self, timeout=3):
+        """
+        Block until the screen differs from the reference
+
+        Returns
+        -------
+        bool
+            False when nothing changed within timeout seconds
+        """
+        if self.reference is None:
+            self.mark()
+        start = time.time()
+        while time.time() - start <= timeout:
+            img, small = self.next_frame()
+            if small.shape == self.reference.shape and frame_energy(small, self.reference) <= self.threshold:
+                continue
+            self.img = img
+            LOG.debug(f'Screen changed after {time.time() - start:.2f}s')
+            return True
+        return False
+
+    def wait_stable(self, stable_ms=None, timeout=10):
+        """
+        Block until the screen has not changed for stable_ms milliseconds
+
+        Returns
+        -------
+        np.ndarray
+            the settled frame, or the latest one when the screen kept changing for timeout seconds
+        """
+        if stable_ms is None:
+            stable_ms = self.stable_ms
+        start = time.time()
+        img, prev = self.next_frame()
+        still_since = time.time()
+        while (time.time() - still_since) * 1000 < stable_ms:
+            if time.time() - start > timeout:
+                LOG.info(f'Screen did not settle within {timeout}s')
+                break
+            img, small = self.next_frame()
+            if small.shape != prev.shape or frame_energy(small, prev) > self.threshold:
+                still_since = time.time()
+            prev = small
+        self.img = img
+        self.reference = prev
+        return img
+
+    def wait_settled(self, changed_timeout=3, stable_ms=None, timeout=10):
+        """
+        Wait for the screen to change from the reference, then to settle
+
+        Use after an action: a screen that does not change within changed_timeout seconds is
+        taken as the action having no visible effect. Returns the settled frame.
+        """
+        start = time.time()
+        changed = self.wait_changed(changed_timeout)
+        img = self.wait_stable(stable_ms, timeout=max(0, timeout - (time.time() - start)))
+        LOG.debug(f'Screen {"settled" if changed else "unchanged"} after {time.time() - start:.2f}s')
+        return img
@@ -1,6 +1,12 @@
-from .import utils
 from . import ocrspace
+from . import ocrengine
 from . import navi
+from .framesource import get_frame_source
+from .screencache import OCRCache
+from .ocrprocessing import OCRResult
+from .templatematch import TemplateClassifier
+from .listreader import ListReader
+from .screenchange import ScreenChangeDetector
 import uiautomator2 as u2
 import time
 
@@ -9,7 +15,11 @@ LOG = logging.getLogger(__name__)
 logging.basicConfig()
 
 APPNAME = "com.nexon.kart"
-API = ocrspace.get_api_endpoint(OCREngine=2, isOverlayRequired=True, isTable='true')
+API = ocrengine.get_engine(ocrspace=dict(OCREngine=2, isOverlayRequired=True, isTable='true'))
+# screens seen while polling for a page, near identical frames reuse their OCR result
+CACHE = OCRCache(maxsize=64, threshold=6)
+# recognises pages with reference images in milliseconds, OCR is used when it is not confident
+CLASSIFIER = TemplateClassifier(navi.PAGES, threshold=0.85)
 
 
 def notice_handler(cur_page):
@@ -19,13 +29,218 @@ def notice_handler(cur_page):
     return False
 
 
-def check_at_page(d, target_page_names, retry_wait=2, max_wait=10, show=False):
+def read_rest_lazily(d, api, img, ocrr, cache=None):
+    # words outside the OCRed regions are read from img the first time a lookup needs them
+    if ocrr is not None and ocrr.rois is not None:
+        ocrr.full_frame = lambda: ocrspace.ocr_frame(d, api, img, cache=cache)
+    return ocrr
+
+
+def template_page(d, api, img, page_class, cache=None):
+    # page recognised from its template, nothing is OCRed until it looks up a word
+    ocrr = OCRResult(d)
+    ocrr.rois = []
+    ocrr.size = (img.shape[1], img.shape[0])
+    ocrr.page_class = page_class
+    navi.PAGE_INDEX.observe(page_class)
+    return page_class(read_rest_lazily(d, api, img, ocrr, cache))
+
+
+def identify_page(d, show=False, source=None, roi=False, expected_pages=None, img=None, api=None, cache=None):
+    """
+    Screenshot and identify the current page
+
+    Pages with reference templates are recognised locally first and returned without OCR, the
+    frame is only read once the page looks up a word.
+    With roi=True only the regions declared by expected_pages (all pages by default) are OCRed,
+    the full frame is OCRed when no page matches the crops, and otherwise only once the page
+    looks up a word outside them.
+    api and cache default to the module's API and CACHE, sessions running side by side pass
+    their own
+    """
+    api = API if api is None else api
+    cache = CACHE if cache is None else cache
+    if img is None:
+        img = get_frame_source(d, source).get_frame()
+    ocrr = None
+    cur_page = None
+    page_class, score = CLASSIFIER.classify(img)
+    if page_class is not None:
+        LOG.debug(f'{page_class.__name__} matched template with score {score:.2f}')
+        cur_page = template_page(d, api, img, page_class, cache)
+        ocrr = cur_page.ocrr
+    else:
+        rois = navi.page_rois(navi.PAGES if expected_pages is None else expected_pages) if roi else []
+        if rois:
+            ocrr = read_rest_lazily(d, api, img, ocrspace.ocr_frame(d, api, img, rois=rois, cache=cache), cache)
+            cur_page = navi.get_current_page(ocrr)
+        if cur_page is None:
+            ocrr = ocrspace.ocr_frame(d, api, img, cache=cache)
+            cur_page = navi.get_current_page(ocrr)
+    if cur_page is not None:
+        # near identical frames later start from this page
+        cache.remember_page(img, type(cur_page))
+    if show:
+        ocrspace.show_ocr(img, ocrr)
+    return img, cur_page
+
+
+def handle_interrupt(cur_page, detector=None):
+    """Close a pop-up page, collecting the event rewards on the way"""
+    if not cur_page.interrupt:
+        return False
+    if cur_page.name == 'EventsPage':
+        cur_page.claims(wait=None if detector is None else detector.wait_settled)
+    cur_page.exit()
+    return True
+
+
+def expect_page(d, page_class, img, api=None, cache=None):
+    """
+    Check img for page_class only, instead of identifying it among all pages
+
+    A template match decides without OCR. Otherwise only the regions page_class declares are
+    OCRed for the check; the rest of the frame is read when a page action first looks outside
+    them. Returns the page, or None when img shows something else.
+    """
+    api = API if api is None else api
+    cache = CACHE if cache is None else cache
+    template_class, score = CLASSIFIER.classify(img)
+    if template_class is page_class:
+        return template_page(d, api, img, page_class, cache)
+    if template_class is not None:
+        return None
+    ocrr = ocrspace.ocr_frame(d, api, img, rois=page_class.rois, cache=cache)
+    page = page_class(ocrr)
+    if not page.verify():
+        return None
+    read_rest_lazily(d, api, img, ocrr, cache)
+    ocrr.page_class = page_class
+    navi.PAGE_INDEX.observe(page_class)
+    cache.remember_page(img, page_class)
+    return page
+
+
+def navigate_to(d, target_page_name, cur_page=None, max_wait=60, hop_wait=10, max_misses=3, show=False,
+                source=None, detector=None, graph=None, api=None, cache=None):
+    """
+    Go to target_page_name along the cheapest route of the navigation graph
+
+    After each hop only the expected page is checked. The screen is identified among all pages
+    only after max_misses checks in a row failed, then pop-ups on the way are closed, and when
+    a hop landed on another known page the route is planned again from there. Latencies of the
+    hops are recorded in graph.
+
+    Parameters
+    ----------
+    cur_page: navi.Page
+        page currently shown, identified from the screen when None
+    max_wait: float
+        seconds for the whole route
+    hop_wait: float
+        seconds a hop may take before the screen is identified again, at least three times the
+        measured latency of the hop
+    max_misses: int
+        failed checks of the expected page, e.g. while it is loading, before the screen is
+        identified
+    graph: navi.NavGraph
+        defaults to navi.NAV_GRAPH
+
+    Returns
+    -------
+    navi.Page
+        the target page, None when it was not reached within max_wait seconds
+    """
+    api = API if api is None else api
+    cache = CACHE if cache is None else cache
+    graph = navi.NAV_GRAPH if graph is None else graph
+    if detector is None:
+        detector = ScreenChangeDetector(get_frame_source(d, source))
+    start = time.time()
+    while time.time() - start <= max_wait:
+        if cur_page is None:
+            img, cur_page = identify_page(d, show=show, source=source, img=detector.mark(), api=api, cache=cache)
+            if cur_page is None:
+                detector.wait_settled(changed_timeout=1)
+                continue
+        if cur_page.name == target_page_name:
+            return cur_page
+        if cur_page.interrupt:
+            detector.mark()
+            handle_interrupt(cur_page, detector)
+            detector.wait_settled(changed_timeout=2)
+            cur_page = None
+            continue
+        hops = graph.path(cur_page.name, target_page_name)
+        if hops is None:
+            raise RuntimeError(f'No route from {cur_page.name} to {target_page_name}')
+
+        source_name, method, next_name = hops[0]
+        LOG.info(f'{source_name} -> {next_name}')
+        detector.mark()
+        hop_start = time.time()
+        getattr(cur_page, method)()
+        next_class = navi.PAGE_CLASSES[next_name]
+        arrived = None
+        misses = 0
+        while arrived is None and time.time() - hop_start <= max(hop_wait, 3 * graph.cost(source_name, next_name)):
+            img = detector.wait_settled(changed_timeout=1)
+            arrived = expect_page(d, next_class, img, api=api, cache=cache)
+            if arrived is not None:
+                graph.record(source_name, next_name, time.time() - hop_start)
+                break
+            misses += 1
+            if misses < max_misses:
+                continue
+            misses = 0
+            img, landing_page = identify_page(d, img=img, api=api, cache=cache)
+            if landing_page is None or landing_page.name == source_name:
+                # the screen is still loading, or the action has not shown yet
+                continue
+            if landing_page.interrupt:
+                detector.mark()
+                handle_interrupt(landing_page, detector)
+                continue
+            LOG.info(f'Expected {next_name}, landed on {landing_page.name}')
+            arrived = landing_page
+        if show and arrived is not None:
+            ocrspace.show_ocr(img, arrived.ocrr)
+        cur_page = arrived
+
+    LOG.error(f'Could not reach {target_page_name} within {max_wait} seconds')
+    return None
+
+
+def check_at_page(d, target_page_names, retry_wait=2, max_wait=10, show=False, source=None, roi=False, detector=None,
+                  api=None, cache=None):
+    """
+    Wait for one of target_page_names to show up
+
+    Instead of sleeping retry_wait seconds before each look, the screen is identified as soon
+    as it settles; when it is not a target page yet, the next look waits for the screen to
+    change again, at most retry_wait seconds.
+    detector has to be marked before the action leading here, a reference taken afterwards
+    may already show the new page and the change would be missed.
+    """
+    if detector is None:
+        raise ValueError('check_at_page needs a ScreenChangeDetector marked before the action leading here')
+    api = API if api is None else api
+    cache = CACHE if cache is None else cache
     at_target = False
     start = time.time()
+    expected_pages = [
+        page for page in navi.PAGES
+        if page.__name__ in target_page_names or page is navi.NoticePage
+    ]
+    cur_page = None
     while not at_target and time.time() - start <= max_wait:
-        time.sleep(retry_wait)
-        ss_img, ocrr = ocrspace.screenshot_ocr(d, API, show=show,)
-        cur_page = navi.get_current_page(ocrr)
+        if cur_page is None:
+            # the action leading here may not have reached the screen yet
+            img = detector.wait_settled(changed_timeout=min(retry_wait, 1))
+        else:
+            img = detector.wait_settled(changed_timeout=retry_wait)
+        img, cur_page = identify_page(
+            d, show=show, source=source, roi=roi, expected_pages=expected_pages, img=img, api=api, cache=cache)
         if cur_page is None:
             continue
         if notice_handler(cur_page):
@@ -36,12 +251,16 @@ def check_at_page(d, target_page_names, retry_wait=2, max_wait=10, show=False):
     return at_target, cur_page
 
 
-def start_game(d, show=False, max_wait=180):
+def start_game(d, show=False, max_wait=180, source=None, api=None, cache=None):
+    api = API if api is None else api
+    detector = ScreenChangeDetector(get_frame_source(d, source))
+    detector.mark()
     sess = d.session("com.nexon.kart")
     entered = False
     start = time.time()
     at_start, cur_page = check_at_page(
-        d, 'StartPage', retry_wait=5, max_wait=max_wait, show=show)
+        d, 'StartPage', retry_wait=5, max_wait=max_wait, show=show, source=source, detector=detector,
+        api=api, cache=cache)
     if at_start:
         cur_page.start()
         entered = True
@@ -51,84 +270,91 @@ def start_game(d, show=False, max_wait=180):
     
     at_home_page = False
     while not at_home_page and time.time() - start <= max_wait:
-        time.sleep(5)
-        ss_img, ocrr = ocrspace.screenshot_ocr(d, API, show=show,)
+        img = detector.wait_settled(changed_timeout=5)
+        ocrr = ocrspace.ocr_frame(d, api, img)
+        if show:
+            ocrspace.show_ocr(img, ocrr)
         cur_page = navi.get_current_page(ocrr)
         if cur_page is None:
             continue
-        if notice_handler(cur_page):
+        if handle_interrupt(cur_page, detector):
             continue
-        if cur_page.name == 'WelcomePage':
-            cur_page.exit()
-        if cur_page.name == 'SignInRewardsPage':
-            cur_page.exit()
-        if cur_page.name == 'EventsPage':
-            cur_page.claims()
-            cur_page.exit()
         if cur_page.name == 'HomePage':
             at_home_page = True
 
     return at_home_page
 
 
-def enter_club_members_page(d, show=False):
-    ss_img, ocrr = ocrspace.screenshot_ocr(d, API, show=show,)
-    cur_page = navi.get_current_page(ocrr)
-    if not cur_page.name in ('HomePage'):
-        raise RuntimeError('Need to start at home page to run this function')
-
-    cur_page.club_page()
-    at_club_page, cur_page = check_at_page(d, ["ClubHomePage"], show=show)
-    if not at_club_page:
-        raise RuntimeError("Cannot enter club home page")
-    cur_page.members()
-    at_members_page, cur_page = check_at_page(d, ["ClubMembersPage"], show=show)
-    if not at_members_page:
+def enter_club_members_page(d, show=False, source=None, api=None, cache=None):
+    # routed from whatever page is shown, HomePage -> ClubHomePage -> ClubMembersPage from home
+    cur_page = navigate_to(d, 'ClubMembersPage', show=show, source=source, api=api, cache=cache)
+    if cur_page is None:
         raise RuntimeError("Cannot enter club members page")
 
-    return at_members_page
+    return True
 
 
-def add_friends(d, show=False, max_wait=900):
-    ss_img, ocrr = ocrspace.screenshot_ocr(d, API, show=show,)
+def add_friends(d, show=False, max_wait=900, source=None, api=None, cache=None):
+    api = API if api is None else api
+    frame_source = get_frame_source(d, source)
+    detector = ScreenChangeDetector(frame_source)
+    img = detector.mark()
+    ocrr = ocrspace.ocr_frame(d, api, img)
+    if show:
+        ocrspace.show_ocr(img, ocrr)
     cur_page = navi.get_current_page(ocrr)
-    if not cur_page.name == "ClubMembersPage":
+    if cur_page is None or not cur_page.name == "ClubMembersPage":
         raise RuntimeError(
             "Need to start at the club members page to run this function")
 
+    # after each scroll only the newly revealed rows are OCRed
+    reader = ListReader(d, api, navi.ClubMembersPage.list_roi)
+    reader.start(img, ocrr)
     start = time.time()
-    added = []
-    while start - time.time() <= max_wait:
+    added = set()
+    while time.time() - start <= max_wait:
         # get list
         cur_page.get_members()
         unadded = [m for m in cur_page.members if m.text not in added]
-        if len(unadded) == 0:
-            return True
         for member in unadded:
             cur_page.click_member(member)
-            time.sleep(1)
+            detector.wait_settled(changed_timeout=1)
             page_change = False
             tries = 0
             while not page_change and tries < 5:
                 tries += 1
+                detector.mark()
                 cur_page.add_friend(member)
                 page_change, landing_page = check_at_page(
                     d, ["AddFriendPage", "ChatPage"],
                     retry_wait=1,
                     max_wait=5,
-                    show=show
+                    show=show,
+                    source=source,
+                    detector=detector,
+                    api=api,
+                    cache=cache
                 )
                 if landing_page.name == 'AddFriendPage':
                     landing_page.confirm()
                 if landing_page.name == 'ChatPage':
                     landing_page.exit()
-            time.sleep(2)
+            detector.wait_settled(changed_timeout=2)
 
-        added.extend([m.text for m in cur_page.members])
-        cur_page.scroll(direction='down')
-        ss_img, ocrr = ocrspace.screenshot_ocr(d, API, show=show,)
+        added.update([m.text for m in cur_page.members])
+        if unadded:
+            reader.update_frame(detector.mark())
+        expected = cur_page.scroll(direction='down')
+        # the list keeps moving for a moment after the drag
+        img = detector.wait_stable()
+        ocrr = reader.advance(img, expected=expected)
+        if ocrr is None:
+            LOG.info(f'Reached the end of the member list, {len(added)} members processed')
+            return True
+        if show:
+            ocrspace.show_ocr(img, ocrr)
         cur_page = navi.get_current_page(ocrr)
-        if not cur_page.name == "ClubMembersPage":
+        if cur_page is None or not cur_page.name == "ClubMembersPage":
             raise RuntimeError("Unexpected exit from club members page")
 
     return False
@@ -0,0 +1,195 @@
+"""
+Page recognition from reference images
+
+Reference images are cut from 1920 pixel wide device screenshots and kept under images/:
+
+    python -m helpers.templatematch screenshot.png images/home_page.png --box 0.05 0.85 0.6 0.98
+"""
+import argparse
+from pathlib import Path
+import cv2
+import logging
+from .ocrprocessing import roi_to_pixels
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+ROOT = Path(__file__).absolute().parent.parent
+# width of the device screenshots the reference images were cut from
+REFERENCE_WIDTH = 1920
+
+# the close "X" of dialogs, cut from the add friend dialog
+CLOSE_BUTTON = ('images/close_button.png', None, (0.756, 0.225, 0.794, 0.284))
+
+
+def to_gray(img):
+    if img.ndim == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return img
+
+
+def save_template(screenshot, file, box):
+    """
+    Cut a reference image from a device screenshot
+
+    Parameters
+    ----------
+    screenshot: str or np.ndarray
+        screenshot file or BGR frame, scaled to REFERENCE_WIDTH first
+    file: str
+        image path relative to the repo root, e.g. images/home_page.png
+    box: tuple
+        fractional (left, top, right, bottom) box of the element, also the region to declare
+        with the template
+    """
+    img = cv2.imread(str(screenshot)) if isinstance(screenshot, (str, Path)) else screenshot
+    if img is None:
+        raise FileNotFoundError(f'Could not read screenshot {screenshot}')
+    if img.shape[1] != REFERENCE_WIDTH:
+        height = int(round(img.shape[0] * REFERENCE_WIDTH / img.shape[1]))
+        img = cv2.resize(img, (REFERENCE_WIDTH, height), interpolation=cv2.INTER_AREA)
+    left, top, right, bottom = roi_to_pixels(box, img.shape[1], img.shape[0])
+    path = ROOT.joinpath(file)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(str(path), img[top:bottom, left:right])
+    LOG.info(f'Saved {right - left}x{bottom - top} template {file}, declare it as ({file!r}, None, {tuple(box)})')
+    return path
+
+
+class Template:
+    """
+    Reference image of a screen element
+
+    Parameters
+    ----------
+    file: str
+        image path relative to the repo root
+    box: tuple
+        fractional (left, top, right, bottom) box to cut from the image, when the image is a full
+        screenshot; the element is then only searched around the same place on screen
+    region: tuple
+        fractional box the element is searched in, for images cut beforehand; None searches
+        the whole screen
+    """
+    def __init__(self, file, box=None, region=None):
+        self.file = file
+        self.box = box
+        self.region = box if region is None else region
+        path = ROOT.joinpath(file)
+        img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE) if path.is_file() else None
+        if img is None:
+            raise FileNotFoundError(f'Could not read template image {file}')
+        self.ref_width = img.shape[1] if box is not None else REFERENCE_WIDTH
+        if box is not None:
+            left, top, right, bottom = roi_to_pixels(box, img.shape[1], img.shape[0])
+            img = img[top:bottom, left:right]
+        self.image = img
+        self._scaled = {}
+
+    def __repr__(self):
+        return f"Template({self.file}, {self.box}, {self.region})"
+
+    def scaled(self, width):
+        # template resized for a working frame of the given width, cached per width
+        if width not in self._scaled:
+            scale = width / self.ref_width
+            h, w = self.image.shape
+            size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+            self._scaled[width] = cv2.resize(self.image, size, interpolation=cv2.INTER_AREA)
+        return self._scaled[width]
+
+    def match(self, gray, margin=0.03):
+        """
+        Returns
+        -------
+        (score, center)
+            best normalized correlation and its location in gray's coordinates
+        """
+        tpl = self.scaled(gray.shape[1])
+        h, w = gray.shape
+        left, top = 0, 0
+        right, bottom = w, h
+        if self.region is not None:
+            left, top, right, bottom = roi_to_pixels((
+                max(0, self.region[0] - margin), max(0, self.region[1] - margin),
+                min(1, self.region[2] + margin), min(1, self.region[3] + margin)
+            ), w, h)
+        region = gray[top:bottom, left:right]
+        if region.shape[0] < tpl.shape[0] or region.shape[1] < tpl.shape[1]:
+            return 0.0, None
+        res = cv2.matchTemplate(region, tpl, cv2.TM_CCOEFF_NORMED)
+        _, score, _, loc = cv2.minMaxLoc(res)
+        center = (left + loc[0] + tpl.shape[1] // 2, top + loc[1] + tpl.shape[0] // 2)
+        return float(score), center
+
+
+class TemplateClassifier:
+    """
+    Identifies pages from their `templates` without OCR
+
+    Parameters
+    ----------
+    pages: list of Page classes
+    threshold: float
+        minimum correlation to trust a match, below it callers should fall back to OCR
+    work_width: int
+        frames are matched after downscaling to this width
+    """
+    def __init__(self, pages, threshold=0.85, work_width=640):
+        self.threshold = threshold
+        self.work_width = work_width
+        self.templates = []
+        for page in pages:
+            for spec in getattr(page, 'templates', None) or []:
+                try:
+                    self.templates.append((page, Template(*spec)))
+                except FileNotFoundError:
+                    # the page is still found with OCR
+                    LOG.info(f'Skipping missing template {spec} of {page.__name__}, cut it with save_template')
+
+    def prepare(self, img):
+        gray = to_gray(img)
+        if gray.shape[1] > self.work_width:
+            h = int(round(gray.shape[0] * self.work_width / gray.shape[1]))
+            gray = cv2.resize(gray, (self.work_width, h), interpolation=cv2.INTER_AREA)
+        return gray
+
+    def scores(self, img):
+        gray = self.prepare(img)
+        res = {}
+        for page, template in self.templates:
+            score, _ = template.match(gray)
+            res[page] = max(score, res.get(page, 0.0))
+        return res
+
+    def classify(self, img):
+        """
+        Returns
+        -------
+        (page class or None, score)
+        """
+        scores = self.scores(img)
+        if not scores:
+            return None, 0.0
+        page = max(scores, key=scores.get)
+        if scores[page] < self.threshold:
+            return None, scores[page]
+        return page, scores[page]
+
+    def locate(self, img, template):
+        """Center of the template in img coordinates, None if not found"""
+        gray = self.prepare(img)
+        score, center = template.match(gray)
+        if score < self.threshold or center is None:
+            return None
+        factor = img.shape[1] / gray.shape[1]
+        return int(center[0] * factor), int(center[1] * factor)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('screenshot')
+    parser.add_argument('file')
+    parser.add_argument('--box', type=float, nargs=4, required=True, metavar=('LEFT', 'TOP', 'RIGHT', 'BOTTOM'))
+    args = parser.parse_args()
+    save_template(args.screenshot, args.file, args.box)
@@ -0,0 +1,37 @@
+import pytesseract
+from pytesseract import Output
+import cv2
+import logging
+from .ocrprocessing import OCRResult
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+
+def preprocess(img, threshold=205):
+    """
+    img: grayscale image
+    """
+    img = cv2.threshold(img, threshold, 255, cv2.THRESH_BINARY)[1]
+    img = cv2.blur(img, (5, 5))
+    return img
+
+
+class TesseractEngine:
+    """Offline OCR engine, returns the same OCRResult as the OCR.space engine"""
+    name = 'tesseract'
+
+    def __init__(self, lang='eng', config='--psm 11', min_conf=10, threshold=None):
+        self.lang = lang
+        self.config = config
+        self.min_conf = min_conf
+        self.threshold = threshold
+
+    def recognize(self, img):
+        gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        if self.threshold is not None:
+            gray = preprocess(gray, threshold=self.threshold)
+        return pytesseract.image_to_data(gray, lang=self.lang, config=self.config, output_type=Output.DICT)
+
+    def parse(self, d, raw):
+        return OCRResult(d, raw=raw).parse_raw_tesseract(min_conf=self.min_conf)
@@ -0,0 +1,178 @@
+from pathlib import Path
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import cv2
+import pandas as pd
+import logging
+from .utils import istime
+from .ocrprocessing import roi_to_pixels
+from . import ocrspace
+from . import navi
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+DB_FILE = 'data/time_trials.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS times (
+    track TEXT NOT NULL,
+    member TEXT NOT NULL,
+    time REAL NOT NULL,
+    time_text TEXT NOT NULL,
+    observed_at REAL NOT NULL,
+    PRIMARY KEY (track, member)
+);
+CREATE INDEX IF NOT EXISTS times_member ON times (member);
+CREATE TABLE IF NOT EXISTS leaderboards (
+    track TEXT PRIMARY KEY,
+    hash TEXT NOT NULL,
+    box TEXT NOT NULL,
+    scraped_at REAL NOT NULL
+);
+"""
+
+# only overwrites a stored time with a better one
+UPSERT = """
+INSERT INTO times (track, member, time, time_text, observed_at) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (track, member) DO UPDATE SET
+    time = excluded.time, time_text = excluded.time_text, observed_at = excluded.observed_at
+WHERE excluded.time < times.time
+"""
+
+
+def parse_time(text):
+    """Seconds of a lap time shown as mm:ss:cc"""
+    match = istime(text)
+    if match is None:
+        raise ValueError(f'{text} is not a lap time')
+    minutes, seconds, centis = (int(group) for group in match.groups())
+    return minutes * 60 + seconds + centis / 100
+
+
+class TimeTrialStore:
+    """
+    Best time trial times of club members per track, in SQLite
+
+    Times are kept per (track, member) and only replaced by better ones. For every track the
+    digest of its binarized leaderboard is kept as well, so a leaderboard that did not change
+    at all since it was last read is recognised from the screen without OCR. Perceptual hashes
+    do not work here, they barely change when a few digits do.
+
+    Parameters
+    ----------
+    file: str
+        database file, created with its directory if missing
+    """
+    def __init__(self, file=DB_FILE):
+        self.file = Path(file)
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        # shared by the device threads of the orchestrator, writes are serialized
+        self.conn = sqlite3.connect(str(self.file), check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"TimeTrialStore({self.file})"
+
+    def close(self):
+        self.conn.close()
+
+    def upsert_times(self, track, times, observed_at=None):
+        """
+        Store a batch of (member, time text) of one track in a single transaction
+
+        Returns the number of times that were new or better than the stored ones
+        """
+        observed_at = time.time() if observed_at is None else observed_at
+        rows = [(track, member, parse_time(text), text, observed_at) for member, text in times]
+        with self.lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(UPSERT, rows)
+            return self.conn.total_changes - before
+
+    def leaderboard(self, track):
+        # (digest, fractional box) of the leaderboard as last read, None if never read
+        with self.lock:
+            row = self.conn.execute('SELECT hash, box FROM leaderboards WHERE track = ?', (track,)).fetchone()
+        if row is None:
+            return None
+        return row[0], tuple(json.loads(row[1]))
+
+    def leaderboard_hash(self, img, box):
+        # sha1 of the leaderboard region binarized with Otsu's threshold, any changed digit
+        # changes it while small brightness changes of the background do not
+        w, h = img.shape[1], img.shape[0]
+        left, top, right, bottom = roi_to_pixels(box, w, h)
+        region = img[top:bottom, left:right]
+        if region.ndim == 3:
+            region = cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(region, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return hashlib.sha1(binary.tobytes()).hexdigest()
+
+    def leaderboard_changed(self, track, img):
+        """Whether the leaderboard of track on img differs from the one last read"""
+        stored = self.leaderboard(track)
+        if stored is None:
+            return True
+        digest, box = stored
+        return digest != self.leaderboard_hash(img, box)
+
+    def record(self, track, pairs, img, box, observed_at=None):
+        """
+        Store the (name_word, time_word) pairs read from a leaderboard and remember its hash
+
+        box is the fractional (left, top, right, bottom) region of the leaderboard on img
+        """
+        observed_at = time.time() if observed_at is None else observed_at
+        changed = self.upsert_times(track, [(name.text, time_word.text) for name, time_word in pairs], observed_at)
+        value = self.leaderboard_hash(img, box)
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO leaderboards (track, hash, box, scraped_at) VALUES (?, ?, ?, ?)',
+                (track, value, json.dumps(list(box)), observed_at)
+            )
+        return changed
+
+    def best_times(self, track=None, member=None):
+        query = 'SELECT track, member, time, time_text, observed_at FROM times'
+        conditions = []
+        params = []
+        if track is not None:
+            conditions.append('track = ?')
+            params.append(track)
+        if member is not None:
+            conditions.append('member = ?')
+            params.append(member)
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        with self.lock:
+            df = pd.read_sql_query(query + ' ORDER BY track, time', self.conn, params=params)
+        df['observed_at'] = pd.to_datetime(df['observed_at'], unit='s')
+        return df
+
+
+def scrape_track(d, api, store, track, img, cache=None):
+    """
+    Read the leaderboard of the time trial page on img into the store, unless it is unchanged
+
+    Returns
+    -------
+    int
+        number of new or improved times, None when the leaderboard was skipped
+    """
+    if not store.leaderboard_changed(track, img):
+        LOG.info(f'Leaderboard of {track} unchanged, skipping OCR')
+        return None
+    ocrr = ocrspace.ocr_frame(d, api, img, cache=cache)
+    page = navi.TimeTrialHomePage(ocrr)
+    pairs = page.get_name_time_pairs()
+    h, w = img.shape[:2]
+    left, top, right, bottom = page.ranking_box
+    changed = store.record(track, pairs, img, (left / w, top / h, right / w, bottom / h))
+    LOG.info(f'Read {len(pairs)} times of {track}, {changed} new or improved')
+    return changed
@@ -0,0 +1,289 @@
+from difflib import get_close_matches
+from pathlib import Path
+import re
+import numpy as np
+import logging
+from .utils import read_yaml_file, write_yaml_file
+from .ocrprocessing import cluster_rows, join_words, roi_to_pixels
+from .framesource import get_frame_source
+from .screenchange import ScreenChangeDetector, frame_energy
+from .listreader import estimate_scroll
+from .batchocr import ocr_batch
+from . import ocrspace
+
+LOG = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+TRACK_INDEX_FILE = 'data/track_index.yml'
+
+
+def normalize_name(name):
+    return re.sub(r'\s+', ' ', name).strip().lower()
+
+
+def track_names(words, box=None, margin=2):
+    """
+    Track names among the words of the track list, as joined Words
+
+    A name ends with the word holding its closing bracket, e.g. "Mushroom Forest (Hard)";
+    a row can hold several names side by side. With a (left, top, right, bottom) box, names
+    within margin pixels of its top or bottom are left out, they are cut by the list edge and
+    their position is off.
+    """
+    tracks = []
+    for row in cluster_rows(words):
+        name = []
+        for word in sorted(row, key=lambda w: w.left):
+            name.append(word)
+            if ')' in word.text:
+                tracks.append(join_words(name))
+                name = []
+    if box is not None:
+        tracks = [track for track in tracks if track.top > box[1] + margin and track.bottom < box[3] - margin]
+    return tracks
+
+
+class TrackIndex:
+    """
+    Where each track sits in the track selection list, kept on disk between runs
+
+    Positions are the y of the track name from the top of the list scrolled all the way up,
+    in fractions of the screen height so they hold for any resolution. `end` is how far the
+    list scrolls, in the same unit, None until a sweep reached the bottom.
+
+    Parameters
+    ----------
+    file: str
+        yaml file the index is loaded from and saved to
+    """
+    def __init__(self, file=TRACK_INDEX_FILE):
+        self.file = Path(file)
+        self.tracks = {}
+        self.end = None
+        if self.file.exists():
+            data = read_yaml_file(self.file) or {}
+            self.tracks = data.get('tracks') or {}
+            self.end = data.get('end')
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __repr__(self):
+        return f"TrackIndex({len(self)} tracks, {self.file})"
+
+    def save(self):
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        write_yaml_file({'tracks': self.tracks, 'end': self.end}, self.file)
+
+    def add(self, name, position):
+        self.tracks[normalize_name(name)] = float(position)
+
+    def find(self, name, cutoff=0.8):
+        """Indexed name closest to name, OCR often drops or swaps a character"""
+        name = normalize_name(name)
+        if name in self.tracks:
+            return name
+        matches = get_close_matches(name, self.tracks, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+    def get(self, name):
+        key = self.find(name)
+        return None if key is None else self.tracks[key]
+
+    def record(self, words, offset, height, box=None):
+        """Add the tracks among words of a frame scrolled offset pixels from the top of the list"""
+        for track in track_names(words, box):
+            self.add(track.text, (track.center[1] + offset) / height)
+
+    def list_offset(self, words, height, box=None):
+        """
+        How far the list is scrolled, in pixels, from the indexed tracks visible in words
+
+        Returns None when none of them is indexed
+        """
+        offsets = []
+        for track in track_names(words, box):
+            position = self.get(track.text)
+            if position is not None:
+                offsets.append(position * height - track.center[1])
+        if not offsets:
+            return None
+        return float(np.median(offsets))
+
+
+def scroll_until_stopped(page, frame_source, direction='up', max_scrolls=30):
+    # flings the list to its end, which is reached when a scroll leaves the screen unchanged;
+    # compared at a higher resolution than usual since a list scrolled by whole rows looks
+    # much the same downscaled
+    detector = ScreenChangeDetector(frame_source, work_width=640, threshold=1.0)
+    img = detector.mark()
+    for _ in range(max_scrolls):
+        page.scroll(direction=direction)
+        new_img = detector.wait_stable()
+        if frame_energy(detector.prepare(img), detector.prepare(new_img)) <= detector.threshold:
+            break
+        img = new_img
+    return img
+
+
+def drag_list(page, box, distance):
+    """
+    Scroll the list content up by distance pixels (down when negative) with one slow drag
+
+    Slow drags move the list by the drag distance without flinging, distance has to fit in
+    the list box
+    """
+    left, top, right, bottom = box
+    x = (left + right) / 2
+    center = (top + bottom) / 2
+    page.ocrr.drag(loc1=[x, center + distance / 2], loc2=[x, center - distance / 2], duration=1)
+
+
+def build_track_index(d, api, page, index=None, source=None, max_scrolls=30, step=0.6, min_response=0.1):
+    """
+    Sweep the whole track list once and index every track
+
+    The list is scrolled to the top, then down step list heights at a time so consecutive
+    screens overlap. Scrolls are measured on the frames and all screens are OCRed together in
+    batched requests at the end.
+
+    Parameters
+    ----------
+    d: uiautomator2 device
+    api: OCR engine
+    page: navi.TrackSelectionPage
+        current page, its words give the geometry of the drags
+    index: TrackIndex
+        index to fill, a new one at TRACK_INDEX_FILE by default
+    Returns
+    -------
+    TrackIndex
+    """
+    index = TrackIndex() if index is None else index
+    frame_source = get_frame_source(d, source)
+    img = frame_source.get_frame()
+    h, w = img.shape[:2]
+    box = roi_to_pixels(page.list_roi, w, h)
+    img = scroll_until_stopped(page, frame_source, direction='up', max_scrolls=max_scrolls)
+    distance = step * (box[3] - box[1])
+
+    detector = ScreenChangeDetector(frame_source)
+    detector.mark(img)
+    frames = [img]
+    offsets = [0]
+    at_end = False
+    for _ in range(max_scrolls):
+        drag_list(page, box, distance)
+        new_img = detector.wait_stable()
+        shift, score = estimate_scroll(frames[-1], new_img, box, expected=distance)
+        if score < min_response:
+            LOG.warning(f'Lost track of the list position (response {score:.2f}), indexing what was seen so far')
+            break
+        if abs(shift) < 2:
+            at_end = True
+            break
+        frames.append(new_img)
+        offsets.append(offsets[-1] + shift)
+
+    results = ocr_batch(d, api, frames, rois=[page.list_roi])
+    # tracks seen on two consecutive screens give their exact scroll, the pixel estimate can be
+    # off by whole rows when the last scroll stops short at the end of the list
+    seen = [{normalize_name(track.text): track.center[1] for track in track_names(ocrr.words, box)} for ocrr in results]
+    for i in range(1, len(frames)):
+        common = seen[i - 1].keys() & seen[i].keys()
+        shift = offsets[i] - offsets[i - 1]
+        if common:
+            shift = float(np.median([seen[i - 1][name] - seen[i][name] for name in common]))
+        offsets[i] = offsets[i - 1] + shift
+    if at_end:
+        index.end = offsets[-1] / h
+    for ocrr, offset in zip(results, offsets):
+        index.record(ocrr.words, offset, h, box)
+    index.save()
+    LOG.info(f'Indexed {len(index)} tracks from {len(frames)} screens')
+    return index
+
+
+def select_track(page, name, index, api, source=None, max_drag=0.8, band=0.12):
+    """
+    Scroll straight to an indexed track, check it with one small OCR and click it
+
+    Parameters
+    ----------
+    page: navi.TrackSelectionPage
+        current page, with an OCR result of the current screen
+    name: str
+        track name as shown in the list
+    index: TrackIndex
+    api: OCR engine
+    max_drag: float
+        longest single drag as a fraction of the list height
+    band: float
+        height of the strip OCRed around the expected track position, fraction of screen height
+
+    Returns
+    -------
+    bool
+        whether the track was found and clicked; when it was not where the index said, the
+        whole list screen is read and the index corrected with the tracks on it
+    """
+    d = page.ocrr.d
+    position = index.get(name)
+    if position is None:
+        raise KeyError(f'Track {name} is not indexed, sweep the list with build_track_index first')
+    frame_source = get_frame_source(d, source)
+    img = frame_source.get_frame()
+    h, w = img.shape[:2]
+    left, top, right, bottom = roi_to_pixels(page.list_roi, w, h)
+    box = (left, top, right, bottom)
+    table = page.ocrr.table
+    visible = table.select(table.in_box(box))
+    key = index.find(name)
+    tracks = {normalize_name(track.text): track for track in track_names(visible, box)}
+    if key in tracks:
+        # already on screen, the page's own OCR result is enough
+        page.ocrr.click(tracks[key])
+        return True
+    offset = index.list_offset(visible, h, box)
+    if offset is None:
+        LOG.info('No indexed track on screen, scrolling to the top of the list')
+        scroll_until_stopped(page, frame_source, direction='up')
+        offset = 0
+
+    # scroll so the track ends up in the middle of the list, as far as the list can scroll
+    center = (top + bottom) / 2
+    limit = max_drag * (bottom - top)
+    wanted = max(0, position * h - center)
+    if index.end is not None:
+        wanted = min(wanted, index.end * h)
+    remaining = wanted - offset
+    while abs(remaining) >= 1:
+        step = float(np.clip(remaining, -limit, limit))
+        drag_list(page, box, step)
+        remaining -= step
+    img = ScreenChangeDetector(frame_source).wait_stable()
+
+    target = position * h - wanted
+    strip = (
+        left / w, max(top, target - band * h / 2) / h,
+        right / w, min(bottom, target + band * h / 2) / h
+    )
+    ocrr = ocrspace.ocr_frame(d, api, img, rois=[strip])
+    tracks = {normalize_name(track.text): track for track in track_names(ocrr.words)}
+    match = get_close_matches(key, tracks, n=1, cutoff=0.8)
+    if match:
+        ocrr.click(tracks[match[0]])
+        return True
+
+    LOG.warning(f'Track {name} is not where the index says, reading the whole list screen')
+    ocrr = ocrspace.ocr_frame(d, api, img, rois=[page.list_roi])
+    offset = index.list_offset(ocrr.words, h, box)
+    if offset is not None:
+        index.record(ocrr.words, offset, h, box)
+        index.save()
+    tracks = {normalize_name(track.text): track for track in track_names(ocrr.words)}
+    match = get_close_matches(key, tracks, n=1, cutoff=0.8)
+    if not match:
+        return False
+    ocrr.click(tracks[match[0]])
+    return True
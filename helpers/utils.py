@@ -13,11 +13,16 @@ def showimg(img):
     plt.show()
 
     
-def screenshot(d, show=False, target='gray'):
-    img = d.screenshot(format='opencv')
-    if target == 'gray':
+def screenshot(d, show=False, target='gray', source=None):
+    # source: a frame source, e.g. framesource.ScrcpyFrameSource, instead of a device screenshot
+    img = d.screenshot(format='opencv') if source is None else source.get_frame()
+    if img.ndim == 2:
+        # gray mode scrcpy frames already are the luminance plane
+        if target == 'rgb':
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    elif target == 'gray':
         img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    if target == 'rgb':
+    elif target == 'rgb':
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
     if show:
         showimg(img)
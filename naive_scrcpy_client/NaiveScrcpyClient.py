@@ -10,21 +10,79 @@ import traceback
 import subprocess
 import ctypes
 from .FFmpegWrapper import AVFormatContext, AVCodecContext, AVPacket, AVFrame, read_packet_func
-from threading import Thread
-from collections import deque
+from threading import Thread, Lock, Condition
 import re
 
 IP_PATTERN = re.compile("^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d+$")
 
+# control messages understood by the server version started below, sent on the video socket
+CONTROL_KEYCODE = 0
+CONTROL_TEXT = 1
+CONTROL_MOUSE = 2
+CONTROL_SCROLL = 3
+CONTROL_COMMAND = 4
+# android MotionEvent actions and buttons
+ACTION_DOWN = 0
+ACTION_UP = 1
+ACTION_MOVE = 2
+BUTTON_PRIMARY = 1
+
+
+def mouse_message(action, x, y, width, height, buttons=BUTTON_PRIMARY):
+    """
+    Touch event at (x, y) of a width x height frame, injected as a finger on the touchscreen
+
+    The server drops events whose frame size differs from the one it currently streams
+    """
+    return struct.pack('>BBiHHHH', CONTROL_MOUSE, action, buttons, int(x), int(y), width, height)
+
+
+def scroll_message(x, y, width, height, h_scroll, v_scroll):
+    return struct.pack('>BHHHHii', CONTROL_SCROLL, int(x), int(y), width, height, h_scroll, v_scroll)
+
 
 class ScrcpyDecoder:
     def __init__(self, _config):
         self.buff_size = _config.get('buff_size', 0x100000)
         self.lib_path = _config.get('lib_path', 'lib')
-        self.img_queue = deque(maxlen=int(_config.get('deque_length', 5)))
+
+        # frame conversion: 'bgr' or 'gray' (luminance plane only)
+        self.color_mode = _config.get('color_mode', 'bgr')
+        # converted frames are written into a ring of preallocated buffers, a frame stays valid
+        # until ring_size newer frames have been converted
+        self.ring_size = int(_config.get('ring_size', 4))
+        self.ring = []
+        self.ring_index = 0
+        self.yuv_buffer = None
+
+        # 'continuous' converts every decoded frame, 'on_demand' only converts when a frame is
+        # asked for; target_fps > 0 additionally converts in the background at most that often
+        self.decode_mode = _config.get('decode_mode', 'continuous')
+        self.target_fps = float(_config.get('target_fps', 0))
+        # latest frame slot: every packet is still decoded to keep the codec state valid, the
+        # newest decoded picture is converted lazily when it is pending
+        self.frame_lock = Lock()
+        # notified for every decoded frame, see wait_for_frame
+        self.frame_ready = Condition(self.frame_lock)
+        self.latest_frame = None
+        # decoded frames are numbered from 1, frame_seq/frame_pts describe latest_frame
+        self.decoded_seq = 0
+        self.decoded_pts = None
+        self.frame_seq = 0
+        self.frame_pts = None
+        self.pending = False
+        self.last_publish = 0
+        self.consumed_seq = 0
 
         # TCP
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # control messages are written by the bot threads while the decoder thread reads
+        self.send_lock = Lock()
+        self.connected = Condition()
+        # (width, height) of the streamed frames, from the device info then from decoded frames
+        self.frame_size = None
+        # gets the device info and every chunk of the raw stream when set, see helpers.replay
+        self.recorder = None
         self.port = _config.get('adb_port', 61550)
 
         # pointers
@@ -183,10 +241,11 @@ class ScrcpyDecoder:
                 if ret < 0:
                     print("Could not send video packet: %d" % ret)
                     break
-                ret = lib_avcodec.avcodec_receive_frame(self.codec_ctx_ptr, self.frame_ptr)
-                if not ret:
-                    self.push_frame(self.frame_ptr)
-                else:
+                with self.frame_lock:
+                    ret = lib_avcodec.avcodec_receive_frame(self.codec_ctx_ptr, self.frame_ptr)
+                    if not ret:
+                        self.push_frame(self.frame_ptr)
+                if ret:
                     print("Could not receive video frame: %d" % ret)
                 lib_avcodec.av_packet_unref(ctypes.byref(packet))
             else:
@@ -197,39 +256,119 @@ class ScrcpyDecoder:
 
     def close_decoder(self):
         self.should_run = False
+        with self.frame_ready:
+            self.frame_ready.notify_all()
         if self.decode_thread:
             self.decode_thread.join()
             self.decode_thread = None
 
-    def push_frame(self, frame_ptr):
+    def _alloc_buffers(self, w, h):
+        if self.yuv_buffer is not None and self.yuv_buffer.shape == (h + h // 2, w):
+            return
+        self.yuv_buffer = np.empty((h + h // 2, w), dtype=np.uint8)
+        shape = (h, w) if self.color_mode == 'gray' else (h, w, 3)
+        self.ring = [np.empty(shape, dtype=np.uint8) for _ in range(self.ring_size)]
+        self.ring_index = 0
+
+    def convert_frame(self, frame_ptr):
+        """
+        Convert the decoded YUV420P AVFrame into the next ring buffer
+
+        The planes are read in place through their real linesizes. In 'bgr' mode they are packed
+        once into a reused I420 buffer for cv2.cvtColor, in 'gray' mode only the Y plane is copied.
+        """
         frame = frame_ptr.contents
         w = frame.width
         h = frame.height
-        img_yuv = np.zeros((h + h // 2, w, 1), dtype=np.uint8)
-        img_yuv[:h, :] = np.ctypeslib.as_array(frame.data[0], shape=(h, frame.linesize[0], 1))[:, :w]
-        img_u = np.ctypeslib.as_array(frame.data[1], shape=(h // 2, frame.linesize[1], 1))[:, :w // 2]
-        img_v = np.ctypeslib.as_array(frame.data[2], shape=(h // 2, frame.linesize[2], 1))[:, :w // 2]
-        img_yuv[h:h + h // 4, : w // 2] = img_u[::2, :]
-        img_yuv[h + h // 4:, : w // 2] = img_v[::2, :]
-        img_yuv[h:h + h // 4, w // 2:] = img_u[1::2, :]
-        img_yuv[h + h // 4:,  w // 2:] = img_v[1::2, :]
-        img = cv2.cvtColor(img_yuv, cv2.COLOR_YUV2BGR_I420)
-        self.img_queue.append(img)
+        self._alloc_buffers(w, h)
+        out = self.ring[self.ring_index]
+        self.ring_index = (self.ring_index + 1) % self.ring_size
+
+        img_y = np.ctypeslib.as_array(frame.data[0], shape=(h, frame.linesize[0]))[:, :w]
+        if self.color_mode == 'gray':
+            np.copyto(out, img_y)
+            return out
+
+        img_u = np.ctypeslib.as_array(frame.data[1], shape=(h // 2, frame.linesize[1]))[:, :w // 2]
+        img_v = np.ctypeslib.as_array(frame.data[2], shape=(h // 2, frame.linesize[2]))[:, :w // 2]
+        # I420: full Y plane, then the U and V planes each packed as h // 2 rows of w // 2
+        np.copyto(self.yuv_buffer[:h], img_y)
+        np.copyto(self.yuv_buffer[h:h + h // 4].reshape(h // 2, w // 2), img_u)
+        np.copyto(self.yuv_buffer[h + h // 4:].reshape(h // 2, w // 2), img_v)
+        cv2.cvtColor(self.yuv_buffer, cv2.COLOR_YUV2BGR_I420, dst=out)
+        return out
+
+    def _publish(self, frame_ptr):
+        # called with frame_lock held
+        self.latest_frame = self.convert_frame(frame_ptr)
+        self.frame_seq = self.decoded_seq
+        self.frame_pts = self.decoded_pts
+        self.pending = False
+        self.last_publish = time.time()
 
-    def get_next_frame(self, latest_image=False):
-        if not self.img_queue:
-            return None
+    def push_frame(self, frame_ptr):
+        # called by the decoder thread with frame_lock held, for every decoded frame
+        self.decoded_seq += 1
+        self.decoded_pts = frame_ptr.contents.pts
+        # the stream changes size when the device rotates
+        self.frame_size = (frame_ptr.contents.width, frame_ptr.contents.height)
+        if self.decode_mode == 'continuous':
+            convert = self.target_fps <= 0 or time.time() - self.last_publish >= 1 / self.target_fps
+        else:
+            convert = self.target_fps > 0 and time.time() - self.last_publish >= 1 / self.target_fps
+        if convert:
+            self._publish(frame_ptr)
         else:
-            img = self.img_queue.popleft()
-            if latest_image:
-                while self.img_queue:
-                    img = self.img_queue.popleft()
-            return img
+            self.pending = True
+        self.frame_ready.notify_all()
+
+    def request_frame(self):
+        """Latest frame, converting the newest decoded picture first if it has not been yet"""
+        with self.frame_lock:
+            if self.pending and self.frame_ptr:
+                self._publish(self.frame_ptr)
+            return self.latest_frame
+
+    def wait_for_frame(self, after_seq=0, timeout=None):
+        """
+        Block until a frame newer than after_seq has been decoded
+
+        Parameters
+        ----------
+        after_seq: int
+            sequence number of the last frame seen, e.g. decoded_seq read before a click
+        timeout: float
+            seconds to wait, None waits until the decoder stops
+        Returns
+        -------
+        (img, seq, pts)
+            the latest frame with its sequence number and decoder timestamp, None on timeout
+        """
+        with self.frame_ready:
+            self.frame_ready.wait_for(lambda: self.decoded_seq > after_seq or not self.should_run, timeout)
+            if self.decoded_seq <= after_seq:
+                return None
+            if self.pending and self.frame_ptr:
+                self._publish(self.frame_ptr)
+            self.consumed_seq = self.frame_seq
+            return self.latest_frame, self.frame_seq, self.frame_pts
+
+    def get_next_frame(self, latest_image=False):
+        # latest_image is kept for compatibility, there is only ever the latest frame
+        with self.frame_lock:
+            if self.pending and self.frame_ptr:
+                self._publish(self.frame_ptr)
+            if self.latest_frame is None or self.frame_seq == self.consumed_seq:
+                return None
+            self.consumed_seq = self.frame_seq
+            return self.latest_frame
 
     def receive_data(self, c_size):
         while self.should_run:
             try:
                 data = self.sock.recv(c_size)
+                if self.recorder is not None and data:
+                    self.recorder.video_data(data)
                 return len(data), data
             except socket.timeout:
                 continue
@@ -237,7 +376,14 @@ class ScrcpyDecoder:
                 return 0, []
 
     def send_data(self, data):
-        return self.sock.send(data)
+        with self.send_lock:
+            self.sock.sendall(data)
+        return len(data)
+
+    def wait_connected(self, timeout=5):
+        # the socket connects in the decoder thread, control messages can be sent after that
+        with self.connected:
+            return self.connected.wait_for(lambda: self.frame_size is not None, timeout)
 
     def _receive_info(self):
         dummy_byte = self.sock.recv(1)
@@ -255,6 +401,11 @@ class ScrcpyDecoder:
         res = self.sock.recv(4)
         frame_width, frame_height = struct.unpack(">HH", res)
         print("WxH: " + str(frame_width) + "x" + str(frame_height))
+        if self.recorder is not None:
+            self.recorder.header(device_name, frame_width, frame_height)
+        with self.connected:
+            self.frame_size = (frame_width, frame_height)
+            self.connected.notify_all()
 
 
 class NaiveScrcpyClient:
@@ -263,23 +414,30 @@ class NaiveScrcpyClient:
         self.lib_path = self.config.get('lib_path', 'lib')
         self.adb = self.config.get('adb_path', 'adb')
         self.adb_device = self.config.get('adb_device', '')
-        if self.adb_device != '':
-            self.adb_device = "-s " + self.adb_device
+        # serial and flag are separate arguments, several devices can be attached at once
+        self.adb_cmd = [self.adb] + (['-s', self.adb_device] if self.adb_device != '' else [])
         self.port = int(self.config.get('adb_port', 61550))
 
         self.adb_sub_process = None
         self.decoder = None
         self.img_cache = None
+        self.img_seq = 0
+        self.img_pts = None
         self.landscape = False
+        # passed on to the decoder, see ScrcpyDecoder.recorder
+        self.recorder = None
 
-        self._connect_and_forward_scrcpy()
+        # False when something else serves adb_port, e.g. a replayed session
+        self.launch_server = self.config.get('launch_server', True)
+        if self.launch_server:
+            self._connect_and_forward_scrcpy()
 
 
     def _connect_and_forward_scrcpy(self):
         try:
             print("Upload JAR...")
             adb_push = subprocess.Popen(
-                [self.adb, self.adb_device, 'push',
+                self.adb_cmd + ['push',
                  'scrcpy-server.jar',
                  '/data/local/tmp/'],
                 stdout=subprocess.PIPE,
@@ -292,7 +450,7 @@ class NaiveScrcpyClient:
                 raise Exception(adb_push_comm)
 
             subprocess.call(
-                [self.adb, self.adb_device, 'forward',
+                self.adb_cmd + ['forward',
                  'tcp:%d' % self.port, 'localabstract:scrcpy'])
             
             '''
@@ -308,7 +466,7 @@ class NaiveScrcpyClient:
             print("Run JAR")
             # app_process / com.genymobile.scrcpy.Server 1.17 info 960 1073741824 60 -1 true - false true 0 false false - -
             self.adb_sub_process = subprocess.Popen(
-                [self.adb, self.adb_device, 'shell',
+                self.adb_cmd + ['shell',
                  'CLASSPATH=/data/local/tmp/scrcpy-server.jar',
                  'app_process', '/', 'com.genymobile.scrcpy.Server',
                  str(int(self.config.get('max_size', 1280))),
@@ -323,13 +481,14 @@ class NaiveScrcpyClient:
 
     def _disable_forward(self):
         subprocess.call(
-            [self.adb, self.adb_device, 'forward', '--remove',
+            self.adb_cmd + ['forward', '--remove',
              'tcp:%d' % self.port])
 
     def start_loop(self):
         if self.decoder:
             return 2
         self.decoder = ScrcpyDecoder(self.config)
+        self.decoder.recorder = self.recorder
         try:
             self.decoder.start_decoder()
             return 0
@@ -344,18 +503,83 @@ class NaiveScrcpyClient:
             self.decoder = None
         if self.adb_sub_process:
             subprocess.Popen(
-                [self.adb, self.adb_device, 'shell',
+                self.adb_cmd + ['shell',
                  '`pkill app_process`',
                  ],
                 stdout=subprocess.PIPE,
             ).wait()
             self.adb_sub_process.wait()
             self.adb_sub_process = None
-        self._disable_forward()
+        if self.launch_server:
+            self._disable_forward()
+
+    def _cache_frame(self, img, seq, pts):
+        self.landscape = img.shape[0] < img.shape[1]
+        # the decoder reuses its ring buffers, callers keep frames for as long as they like
+        self.img_cache = img.copy()
+        self.img_seq = seq
+        self.img_pts = pts
+
+    @property
+    def frame_seq(self):
+        # sequence number of the newest decoded frame, take it before an action and pass it to
+        # wait_for_frame to get the first frame decoded after the action
+        return self.decoder.decoded_seq
+
+    def wait_for_frame(self, after_seq=None, timeout=5):
+        """
+        Wait for a frame decoded after after_seq (the current frame_seq by default)
+
+        Returns the frame, or None when no new frame arrived within timeout seconds; the
+        frame's sequence number and PTS are kept in img_seq and img_pts
+        """
+        if after_seq is None:
+            after_seq = self.frame_seq
+        res = self.decoder.wait_for_frame(after_seq, timeout)
+        if res is None:
+            return None
+        self._cache_frame(*res)
+        return self.img_cache
+
+    @property
+    def frame_size(self):
+        # (width, height) of the streamed frames, the coordinate space of the input methods
+        return self.decoder.frame_size
+
+    def inject(self, data):
+        if self.decoder is None or not self.decoder.wait_connected():
+            raise ConnectionError('scrcpy is not connected, call start_loop first')
+        return self.decoder.send_data(data)
+
+    def touch(self, action, x, y):
+        width, height = self.frame_size
+        return self.inject(mouse_message(action, x, y, width, height))
+
+    def tap(self, x, y, duration=0.02):
+        self.touch(ACTION_DOWN, x, y)
+        time.sleep(duration)
+        self.touch(ACTION_UP, x, y)
+
+    def swipe(self, x1, y1, x2, y2, duration=0.5, interval=0.01):
+        """Press at (x1, y1), move to (x2, y2) in duration seconds with a move event every interval and release"""
+        steps = max(1, int(duration / interval))
+        start = time.time()
+        self.touch(ACTION_DOWN, x1, y1)
+        for i in range(1, steps + 1):
+            delay = start + i * duration / steps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.touch(ACTION_MOVE, x1 + (x2 - x1) * i / steps, y1 + (y2 - y1) * i / steps)
+        self.touch(ACTION_UP, x2, y2)
+
+    def scroll(self, x, y, h_scroll=0, v_scroll=-1):
+        # mouse wheel notches at (x, y), negative v_scroll scrolls down the list, positive back up
+        width, height = self.frame_size
+        return self.inject(scroll_message(x, y, width, height, h_scroll, v_scroll))
 
     def get_screen_frame(self):
-        img = self.decoder.get_next_frame(True)
-        if img is not None:
-            self.landscape = img.shape[0] < img.shape[1]
-            self.img_cache = img.copy()
+        # latest frame if one arrived since the last call, the cached frame otherwise
+        res = self.decoder.wait_for_frame(self.img_seq, timeout=0)
+        if res is not None:
+            self._cache_frame(*res)
         return self.img_cache
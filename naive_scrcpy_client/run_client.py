@@ -32,6 +32,9 @@ if __name__ == '__main__':
         "adb_port": 61550,
         "lib_path": "lib",
         "buff_size": 0x10000,
-        "deque_length": 5
+        "color_mode": "bgr",
+        "ring_size": 4,
+        "decode_mode": "continuous",
+        "target_fps": 0
     }
     run_client(config)
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import threading
+import urllib.request
+import cv2
+import numpy as np
+import pytest
+from aiohttp import web
+from helpers.asyncocr import AsyncOCRClient, AsyncOCRSpaceEngine, OCRRequestError
+from helpers.ocrstub import make_app
+
+
+class StubServer:
+    """ocrstub app served from a background thread on a free port"""
+    def __init__(self, **kwargs):
+        self.app = make_app(**kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.runner = None
+        self.url = None
+
+    async def _start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f'http://{host}:{port}'
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self.loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def stats(self):
+        with urllib.request.urlopen(f'{self.url}/stats') as response:
+            return json.loads(response.read())
+
+
+@pytest.fixture
+def serve():
+    servers = []
+    clients = []
+
+    def start(client_kwargs=None, **kwargs):
+        server = StubServer(**kwargs).start()
+        client = AsyncOCRClient(**dict(dict(backoff=0.01), **(client_kwargs or {})))
+        servers.append(server)
+        clients.append(client)
+        return server, AsyncOCRSpaceEngine('test', client=client, endpoint=f'{server.url}/parse/image')
+
+    yield start
+    for client in clients:
+        client.close()
+    for server in servers:
+        server.stop()
+
+
+def frame(width):
+    return np.full((24, width, 3), 255, dtype=np.uint8)
+
+
+def width_words(data):
+    # one word naming the width of the uploaded image
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return [(f'w{img.shape[1]}', 0, 0, img.shape[1], img.shape[0])]
+
+
+def test_failed_requests_are_retried(serve):
+    server, engine = serve(fail_every=2)
+    for width in (40, 50, 60):
+        words = engine.parse(None, engine.recognize(frame(width))).words
+        assert [word.text for word in words] == ['Club', 'Members']
+    stats = server.stats()
+    assert stats['failed'] == 2
+    assert stats['requests'] == 5
+    assert engine.client.retried == 2
+    assert engine.client.requests == 3
+
+
+def test_gives_up_after_retries(serve):
+    server, engine = serve(client_kwargs=dict(retries=2), fail_every=1)
+    with pytest.raises(OCRRequestError):
+        engine.recognize(frame(40))
+    assert server.stats()['requests'] == 3
+
+
+def test_requests_in_flight_are_capped(serve):
+    server, engine = serve(client_kwargs=dict(max_concurrency=2), latency=0.1)
+    results = engine.recognize_many([frame(40 + i) for i in range(6)])
+    assert len(results) == 6
+    stats = server.stats()
+    assert stats['requests'] == 6
+    assert stats['max_in_flight'] == 2
+
+
+def test_recognize_many_keeps_image_order(serve):
+    server, engine = serve(client_kwargs=dict(max_concurrency=4), words=width_words, latency=0.02)
+    widths = [90, 30, 70, 10, 50, 20, 80, 40]
+    results = engine.recognize_many([frame(width) for width in widths])
+    texts = [engine.parse(None, raw).words[0].text for raw in results]
+    assert texts == [f'w{width}' for width in widths]
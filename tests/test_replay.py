@@ -0,0 +1,95 @@
+import logging
+import numpy as np
+import pytest
+from helpers.ocrprocessing import OCRResult, Word
+from helpers.replay import Cassette, RecordingDevice, RecordingEngine, ReplayDevice, ReplayEngine, SessionRecorder
+
+
+class FakeEngine:
+    """Reads the word list written into the first row of a frame, see screen"""
+    name = 'fake'
+
+    def __init__(self):
+        self.calls = 0
+
+    def recognize(self, img):
+        self.calls += 1
+        return {'texts': [f'word{v}' for v in img[0, :4, 0] if v]}
+
+    def parse(self, d, raw):
+        words = []
+        for i, text in enumerate(raw['texts']):
+            word = Word()
+            word.text, word.x, word.y, word.w, word.h = text, 100 * i, 50, 80, 20
+            words.append(word)
+        return OCRResult(d, raw=raw).set_words(words)
+
+
+class FakeDevice:
+    def __init__(self):
+        self.clicks = []
+
+    def window_size(self):
+        return 1280, 720
+
+    def click(self, x, y):
+        self.clicks.append((x, y))
+
+
+def screen(*values):
+    img = np.zeros((72, 128, 3), dtype=np.uint8)
+    img[0, :len(values), 0] = values
+    img[10:60, 20:100] = 120
+    return img
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    recorder = SessionRecorder()
+    recorder.header('FakeDevice\x00\x00', 1280, 720)
+    engine = RecordingEngine(FakeEngine(), recorder)
+    d = RecordingDevice(FakeDevice(), recorder)
+    d.window_size()
+    for values in [(1, 2), (3,)]:
+        ocrr = engine.parse(d, engine.recognize(screen(*values)))
+        ocrr.click(ocrr.words[0])
+    return Cassette(recorder.save(tmp_path / 'session.zip'))
+
+
+def test_cassette_keeps_the_session(cassette):
+    assert cassette.meta['device_name'] == 'FakeDevice'
+    assert cassette.meta['frame_size'] == [1280, 720]
+    assert len(cassette.ocr) == 2
+    assert [a['action'] for a in cassette.actions] == ['click', 'click']
+    assert ReplayDevice(cassette).window_size() == (1280, 720)
+
+
+def test_replays_recorded_frames(cassette):
+    api = ReplayEngine(cassette)
+    d = ReplayDevice(cassette)
+    for values in [(1, 2), (3,)]:
+        ocrr = api.parse(d, api.recognize(screen(*values)))
+        assert [word.text for word in ocrr.words] == [f'word{v}' for v in values]
+        ocrr.click(ocrr.words[0])
+    assert api.hits == 2
+    assert [(a['action'], a['args']) for a in d.actions] == [(a['action'], a['args']) for a in cassette.actions]
+
+
+def test_unrecorded_frame_is_a_miss(cassette):
+    api = ReplayEngine(cassette)
+    img = screen(1, 2)
+    img[30, 50] = 121
+    with pytest.raises(KeyError):
+        api.recognize(img)
+    assert api.misses == 1
+
+
+def test_similar_frame_only_when_asked(cassette, caplog):
+    img = screen(1, 2)
+    img[30, 50] = 121
+    assert cassette.lookup(img) is None
+    api = ReplayEngine(cassette, threshold=6)
+    with caplog.at_level(logging.WARNING, logger='helpers.replay'):
+        raw = api.recognize(img)
+    assert [word.text for word in api.parse(None, raw).words] == ['word1', 'word2']
+    assert 'similar image' in caplog.text
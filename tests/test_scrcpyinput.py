@@ -0,0 +1,84 @@
+import struct
+import pytest
+from naive_scrcpy_client.NaiveScrcpyClient import (
+    ACTION_DOWN, BUTTON_PRIMARY, CONTROL_MOUSE, CONTROL_SCROLL, NaiveScrcpyClient, ScrcpyDecoder,
+    mouse_message, scroll_message
+)
+from helpers.scrcpyinput import ScrcpyInput, get_input
+from helpers.scrcpystub import FakeScrcpyServer, PAYLOAD_LENGTHS, parse_message
+
+SIZE = (1280, 720)
+
+
+@pytest.fixture
+def server():
+    server = FakeScrcpyServer(size=SIZE).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(server):
+    # connected like start_loop does, without starting the H.264 decoder
+    client = NaiveScrcpyClient({'adb_port': server.port, 'launch_server': False})
+    client.decoder = ScrcpyDecoder(client.config)
+    client.decoder.sock.connect((client.decoder.ip, server.port))
+    client.decoder._receive_info()
+    yield client
+    client.decoder.sock.close()
+
+
+def touches(events):
+    return [(e['action'], e['x'], e['y']) for e in events if e['type'] == 'touch']
+
+
+def test_mouse_message_layout():
+    data = mouse_message(ACTION_DOWN, 100.7, 200, *SIZE)
+    assert len(data) == 1 + PAYLOAD_LENGTHS[CONTROL_MOUSE]
+    assert data == bytes([CONTROL_MOUSE, ACTION_DOWN]) + struct.pack('>iHHHH', BUTTON_PRIMARY, 100, 200, *SIZE)
+    assert parse_message(data[0], data[1:]) == {'type': 'touch', 'action': 'down', 'x': 100, 'y': 200, 'size': SIZE}
+
+
+def test_scroll_message_layout():
+    data = scroll_message(640, 360, *SIZE, 0, -2)
+    assert len(data) == 1 + PAYLOAD_LENGTHS[CONTROL_SCROLL]
+    assert data == bytes([CONTROL_SCROLL]) + struct.pack('>HHHHii', 640, 360, *SIZE, 0, -2)
+    assert parse_message(data[0], data[1:]) == {
+        'type': 'scroll', 'x': 640, 'y': 360, 'size': SIZE, 'h_scroll': 0, 'v_scroll': -2
+    }
+
+
+def test_tap_and_swipe(client, server):
+    assert client.frame_size == SIZE
+    client.tap(120, 210)
+    client.swipe(600, 600, 600, 200, duration=0.05, interval=0.01)
+    client.scroll(640, 360, v_scroll=-2)
+    # tap down and up, swipe down, 5 moves and up, scroll
+    events = server.wait_events(10)
+    assert len(events) == 10
+    moves = touches(events)
+    assert moves[:2] == [('down', 120, 210), ('up', 120, 210)]
+    assert moves[2] == ('down', 600, 600)
+    assert moves[-1] == ('up', 600, 200)
+    path = [y for action, _, y in moves[3:-1]]
+    assert moves[3:-1] and all(action == 'move' for action, _, _ in moves[3:-1])
+    assert path == sorted(path, reverse=True)
+    assert all(e['size'] == SIZE for e in events)
+    assert events[-1] == {
+        'type': 'scroll', 'x': 640, 'y': 360, 'size': SIZE, 'h_scroll': 0, 'v_scroll': -2, 'time': events[-1]['time']
+    }
+
+
+def test_scrcpy_input_click_and_drag(client, server):
+    d = get_input(None, client, 'scrcpy')
+    assert isinstance(d, ScrcpyInput)
+    assert d.window_size() == SIZE
+    d.click(1220, 60)
+    d.drag(100, 500, 900, 500, duration=0.05)
+    moves = touches(server.wait_events(9))
+    assert len(moves) == 9
+    assert moves[:2] == [('down', 1220, 60), ('up', 1220, 60)]
+    assert moves[2] == ('down', 100, 500)
+    assert moves[-1] == ('up', 900, 500)
+    with pytest.raises(AttributeError):
+        d.app_start